@@ -0,0 +1,90 @@
+def count_shift_types(assigned_shifts, shift_type_dict):
+    """
+    Calculate the number of assigned shift types for a person.
+
+    Args:
+    - assigned_shifts (list): List of shifts already assigned to the person.
+    - shift_type_dict (dict): Mapping from shift ID to shift type.
+
+    Returns:
+    - dict: A dictionary with the count of each shift type assigned to the person.
+    """
+    assigned_shift_types = {}
+    for assigned_shift in assigned_shifts:
+        assigned_shift_type = shift_type_dict.get(assigned_shift, 0)
+        assigned_shift_types[assigned_shift_type] = (
+            assigned_shift_types.get(assigned_shift_type, 0) + 1
+        )
+    return assigned_shift_types
+
+
+class AssignmentCounters:
+    """
+    Counters derived from a schedule, kept up to date assignment by assignment.
+
+    The counters are maintained by create_init while building the initial solution
+    and by hard_constraints.apply_move and undo_move afterwards, so the constraints
+    and costs can query them instead of scanning the schedule:
+    - the set of people working every shift, which answers how many enemies of a
+      person work a shift (see data_transformation.create_colleague_dict)
+    - the number of assigned shifts of every shift type per person, in the format
+      of count_shift_types (shift types without shifts have no entry)
+    """
+
+    def __init__(self, schedule, people_data, shifts_data):
+        self.enemy_dict = people_data["enemy_dict"]
+        self.shift_type_dict = shifts_data["shift_type_dict"]
+        self.reset(schedule)
+
+    def reset(self, schedule):
+        """Recount everything from the given schedule."""
+        self.shift_members = {shift_id: set() for shift_id in schedule}
+        self.shift_type_counts = {}
+        for shift_id, shift in schedule.items():
+            for person_id in shift:
+                self.assign(person_id, shift_id)
+
+    def enemies_in_shift(self, person_id, shift_id):
+        """
+        Count the enemies of a person working a shift in O(number of enemies).
+
+        Args:
+        - person_id (int): The person
+        - shift_id (int): The shift
+
+        Returns:
+        - int: The number of people in the shift the person lists as enemy
+        """
+        members = self.shift_members[shift_id]
+        return sum(
+            1
+            for enemy_id in self.enemy_dict.get(person_id, ())
+            if enemy_id != person_id and enemy_id in members
+        )
+
+    def assigned_shift_types(self, person_id):
+        """Return the shift type counts of a person (read only)."""
+        return self.shift_type_counts.get(person_id, {})
+
+    def assign(self, person_id, shift_id):
+        """Update the counters for a person being added to a shift."""
+        self.shift_members[shift_id].add(person_id)
+
+        shift_type = self.shift_type_dict.get(shift_id, 0)
+        shift_type_counts = self.shift_type_counts.setdefault(person_id, {})
+        shift_type_counts[shift_type] = shift_type_counts.get(shift_type, 0) + 1
+
+    def unassign(self, person_id, shift_id):
+        """Update the counters for a person being removed from a shift."""
+        self.shift_members[shift_id].discard(person_id)
+
+        shift_type = self.shift_type_dict.get(shift_id, 0)
+        shift_type_counts = self.shift_type_counts[person_id]
+        shift_type_counts[shift_type] -= 1
+        if shift_type_counts[shift_type] == 0:
+            del shift_type_counts[shift_type]
+
+    def move_person(self, person_id, old_shift_id, new_shift_id):
+        """Update the counters for a person moving from one shift to another."""
+        self.unassign(person_id, old_shift_id)
+        self.assign(person_id, new_shift_id)
@@ -0,0 +1,40 @@
+import threading
+import time
+
+
+class CancellationToken:
+    """
+    Cooperative stop signal for the solver.
+
+    The token is cancelled once cancel() was called or its deadline has passed.
+    The solver loops poll cancelled() and stop with the best schedule found so far.
+
+    For run_parallel_simulated_annealing the event must be shared between
+    processes, e.g. CancellationToken(event=multiprocessing.Manager().Event()).
+    """
+
+    def __init__(self, time_budget=None, event=None):
+        self.event = event if event is not None else threading.Event()
+        self.deadline = time.time() + time_budget if time_budget is not None else None
+
+    def cancel(self):
+        self.event.set()
+
+    def cancelled(self):
+        return self.event.is_set() or (
+            self.deadline is not None and time.time() >= self.deadline
+        )
+
+    def __getstate__(self):
+        # A plain threading.Event cannot be sent to another process
+        if isinstance(self.event, threading.Event):
+            raise TypeError(
+                "CancellationToken needs a process-shared event to be sent to other "
+                "processes, e.g. multiprocessing.Manager().Event()"
+            )
+        return self.__dict__
+
+
+def is_cancelled(cancel_token):
+    """Check an optional cancellation token."""
+    return cancel_token is not None and cancel_token.cancelled()
@@ -0,0 +1,57 @@
+import os
+import pickle
+import tempfile
+
+# Seconds between two checkpoints of a running annealing run
+DEFAULT_CHECKPOINT_INTERVAL = 300
+CHECKPOINT_VERSION = 1
+
+
+def save_checkpoint(path, checkpoint):
+    """
+    Write a checkpoint atomically.
+
+    The checkpoint is pickled to a temporary file next to path, flushed to disk and
+    renamed over path, so a crash leaves either the previous or the new checkpoint
+    but never a partly written one.
+
+    Args:
+    - path (str): The checkpoint file
+    - checkpoint (dict): The checkpoint data
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    file_descriptor, temporary_path = tempfile.mkstemp(
+        dir=directory, prefix=os.path.basename(path) + ".", suffix=".tmp"
+    )
+    try:
+        with os.fdopen(file_descriptor, "wb") as checkpoint_file:
+            pickle.dump(
+                {"version": CHECKPOINT_VERSION, **checkpoint},
+                checkpoint_file,
+                protocol=pickle.HIGHEST_PROTOCOL,
+            )
+            checkpoint_file.flush()
+            os.fsync(checkpoint_file.fileno())
+        os.replace(temporary_path, path)
+    except BaseException:
+        os.unlink(temporary_path)
+        raise
+
+
+def load_checkpoint(path):
+    """
+    Read a checkpoint written by save_checkpoint.
+
+    Args:
+    - path (str): The checkpoint file
+
+    Returns:
+    - dict: The checkpoint data
+    """
+    with open(path, "rb") as checkpoint_file:
+        checkpoint = pickle.load(checkpoint_file)
+    if checkpoint.get("version") != CHECKPOINT_VERSION:
+        raise ValueError(
+            f"Unsupported checkpoint version {checkpoint.get('version')} in {path}"
+        )
+    return checkpoint
@@ -0,0 +1,152 @@
+import math
+
+# Share of the initial temperature a reheat restarts from
+DEFAULT_REHEAT_FRACTION = 0.5
+# Iterations at a fixed temperature before the adaptive schedule cools
+DEFAULT_PLATEAU_LENGTH = 100
+
+
+class GeometricCooling:
+    """
+    Multiplies the temperature by cooling_rate after every iteration.
+
+    This is the original schedule. It ends once the temperature drops to 1, which
+    takes total_iterations iterations from the initial temperature. The other
+    schedules reuse total_iterations as their iteration budget.
+    """
+
+    def __init__(self, initial_temperature, cooling_rate):
+        self.initial_temperature = initial_temperature
+        self.cooling_rate = cooling_rate
+        self.total_iterations = math.ceil(
+            math.log(1 / initial_temperature) / math.log(cooling_rate)
+        )
+        self.reheat(initial_temperature)
+
+    def reheat(self, temperature):
+        """Restart the schedule from the given temperature."""
+        self.temperature = temperature
+        self.iteration = 0
+
+    def finished(self):
+        return self.temperature <= 1
+
+    def step(self, accepted, current_cost):
+        """
+        Update the temperature after an iteration.
+
+        Args:
+        - accepted (bool): Whether the proposed move was accepted
+        - current_cost (float): The cost of the current schedule after the iteration
+        """
+        self.iteration += 1
+        self.temperature *= self.cooling_rate
+
+
+class AcceptanceRateCooling(GeometricCooling):
+    """
+    Steers the temperature towards Lam's target acceptance rate.
+
+    The target rate falls from 100% to 44% in the first 15% of the iterations,
+    stays at 44% until 65% and then falls towards 0 (Lam and Delosme). The
+    acceptance rate is tracked as a moving average over roughly the last 500
+    iterations, and the temperature is lowered while it is above the target and
+    raised while it is below. The schedule ends after total_iterations.
+    """
+
+    def reheat(self, temperature):
+        super().reheat(temperature)
+        self.acceptance_rate = 0.5
+
+    def finished(self):
+        return self.iteration >= self.total_iterations
+
+    def target_acceptance_rate(self):
+        progress = self.iteration / self.total_iterations
+        if progress < 0.15:
+            return 0.44 + 0.56 * 560 ** (-progress / 0.15)
+        if progress < 0.65:
+            return 0.44
+        return 0.44 * 440 ** (-(progress - 0.65) / 0.35)
+
+    def step(self, accepted, current_cost):
+        self.acceptance_rate = (499 * self.acceptance_rate + accepted) / 500
+        if self.acceptance_rate > self.target_acceptance_rate():
+            self.temperature *= 0.999
+        else:
+            self.temperature /= 0.999
+        self.iteration += 1
+
+
+class PlateauCooling(GeometricCooling):
+    """
+    Cools once per plateau of plateau_length iterations, by how much the cost varied.
+
+    The temperature is multiplied by exp(-0.7 * T / sigma), where sigma is the
+    standard deviation of the current cost over the plateau (Huang et al.), so it
+    cools slowly while the cost still varies a lot and quickly once it has settled.
+    The factor is kept between the square and the square root of the geometric
+    factor cooling_rate ** plateau_length, so a run takes at most twice as many
+    iterations as the geometric schedule.
+    """
+
+    def __init__(
+        self, initial_temperature, cooling_rate, plateau_length=DEFAULT_PLATEAU_LENGTH
+    ):
+        self.plateau_length = plateau_length
+        super().__init__(initial_temperature, cooling_rate)
+
+    def reheat(self, temperature):
+        super().reheat(temperature)
+        self._start_plateau()
+
+    def _start_plateau(self):
+        self.plateau_count = 0
+        self.plateau_mean = 0.0
+        self.plateau_squared_deviation = 0.0
+
+    def step(self, accepted, current_cost):
+        self.iteration += 1
+
+        # Welford's update of the cost deviation on the plateau
+        self.plateau_count += 1
+        delta = current_cost - self.plateau_mean
+        self.plateau_mean += delta / self.plateau_count
+        self.plateau_squared_deviation += delta * (current_cost - self.plateau_mean)
+        if self.plateau_count < self.plateau_length:
+            return
+
+        geometric_factor = self.cooling_rate**self.plateau_length
+        deviation = math.sqrt(self.plateau_squared_deviation / (self.plateau_count - 1))
+        if deviation > 0:
+            factor = math.exp(-0.7 * self.temperature / deviation)
+        else:
+            factor = 0.0  # The cost did not move at all, cool as fast as allowed
+        factor = min(max(factor, geometric_factor**2), math.sqrt(geometric_factor))
+        self.temperature *= factor
+        self._start_plateau()
+
+
+COOLING_SCHEDULES = {
+    "geometric": GeometricCooling,
+    "acceptance_rate": AcceptanceRateCooling,
+    "plateau": PlateauCooling,
+}
+
+
+def create_cooling_schedule(name, initial_temperature, cooling_rate, **options):
+    """
+    Create one of the COOLING_SCHEDULES.
+
+    Args:
+    - name (str): The name of the schedule
+    - initial_temperature (float): The starting temperature
+    - cooling_rate (float): The geometric cooling rate, which also sets the budget
+    - options: Further arguments of the schedule, e.g. plateau_length
+
+    Returns:
+    - GeometricCooling: The cooling schedule
+    """
+    if name not in COOLING_SCHEDULES:
+        raise ValueError(f"Unknown cooling schedule: {name}")
+    return COOLING_SCHEDULES[name](initial_temperature, cooling_rate, **options)
@@ -0,0 +1,104 @@
+import random
+from collections import OrderedDict
+
+ZOBRIST_SEED = 20240626
+DEFAULT_COST_CACHE_SIZE = 100000
+
+
+class ZobristHasher:
+    """
+    64-bit Zobrist hashing of the (person, shift) assignment set of a schedule.
+
+    Every (person, shift) pair gets a fixed random key and the hash of a schedule is
+    the XOR of the keys of all its assignments. Moving a person between shifts only
+    XORs out the old key and XORs in the new one, so the hash is maintained in O(1)
+    per move. The keys are drawn from a fixed seed so every worker process agrees on
+    the hash of a schedule.
+    """
+
+    def __init__(self, people_data, shifts_data, seed=ZOBRIST_SEED):
+        rng = random.Random(seed)
+        self.person_index_dict = people_data["person_index_dict"]
+        self.shift_index_dict = shifts_data["shift_index_dict"]
+        self.keys = [
+            [rng.getrandbits(64) for _ in self.shift_index_dict]
+            for _ in self.person_index_dict
+        ]
+
+    def key(self, person_id, shift_id):
+        return self.keys[self.person_index_dict[person_id]][
+            self.shift_index_dict[shift_id]
+        ]
+
+    def hash_schedule(self, assigned_shifts):
+        """
+        Calculate the hash of a schedule from scratch.
+
+        Args:
+        - assigned_shifts (dict): The shifts assigned to each person
+
+        Returns:
+        - int: The 64-bit hash
+        """
+        schedule_hash = 0
+        for person_id, shifts in assigned_shifts.items():
+            for shift_id in shifts:
+                schedule_hash ^= self.key(person_id, shift_id)
+        return schedule_hash
+
+    def apply_move(self, schedule_hash, move):
+        """
+        Update a hash with a move.
+
+        Args:
+        - schedule_hash (int): The hash before the move
+        - move (tuple): The (person_id, old_shift_id, new_shift_id) entries of the move
+
+        Returns:
+        - int: The hash after the move
+        """
+        for person_id, old_shift_id, new_shift_id in move:
+            schedule_hash ^= self.key(person_id, old_shift_id)
+            schedule_hash ^= self.key(person_id, new_shift_id)
+        return schedule_hash
+
+
+class CostCache:
+    """
+    Bounded LRU cache from schedule hash to evaluated total cost.
+
+    The hits and misses are counted to see whether the cache pays off.
+    """
+
+    def __init__(self, max_size=DEFAULT_COST_CACHE_SIZE):
+        self.max_size = max_size
+        self.costs = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, schedule_hash):
+        """Return the cached cost of a schedule hash, or None if it is not cached."""
+        cost = self.costs.get(schedule_hash)
+        if cost is None:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        self.costs.move_to_end(schedule_hash)
+        return cost
+
+    def put(self, schedule_hash, cost):
+        self.costs[schedule_hash] = cost
+        self.costs.move_to_end(schedule_hash)
+        if len(self.costs) > self.max_size:
+            self.costs.popitem(last=False)  # Evict the least recently used entry
+
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups > 0 else 0
+
+    def __repr__(self):
+        return (
+            f"CostCache(size={len(self.costs)}/{self.max_size}, hits={self.hits}, "
+            f"misses={self.misses}, hit_rate={self.hit_rate() * 100:.1f}%)"
+        )
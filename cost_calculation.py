@@ -1,10 +1,9 @@
+import math
 import random
-import statistics
 from io import StringIO
-from datetime import time
-from data_transformation import time_to_seconds_since_midnight
 from logger import logging
 from error_handling import raise_not_found_error
+from assignment_counters import count_shift_types
 
 EXPERIENCE_FACTOR = 1000
 GENDER_DISTRIBUTION_FACTOR = 1000
@@ -16,6 +15,13 @@ CONSECUTIVE_SHIFT_FACTOR = 5
 FRIEND_FACTOR = 1000
 ENEMY_FACTOR = 20000
 NIGHT_SHIFT_FACTOR = 10000
+BALANCE_FACTOR = 50
+MANDATORY_FACTOR = 5000000
+# Share of a friend or enemy match counted for a different shift at the same time
+SAME_TIME_FACTOR = 0.75
+
+# The experience distribution cost is disabled until experience data is provided again
+USE_EXPERIENCE_COST = False
 
 
 DEFAULT_MIN_AMOUNT_SHIFT = 4
@@ -24,9 +30,62 @@ DEFAULT_MAX_AMOUNT_SHIFT = 5
 
 def cost_function(
     schedule, assigned_shifts, people_data, shifts_data, print_costs=False
+):
+    """
+    Calculate the total cost of the schedule together with its explanation.
+
+    Kept for the callers that need the breakdown, see explain_cost. Use cost_value
+    when only the number is needed.
+    """
+    return explain_cost(schedule, assigned_shifts, people_data, shifts_data, print_costs)
+
+
+def cost_value(schedule, assigned_shifts, people_data, shifts_data):
+    """
+    Calculate only the total cost of the schedule.
+
+    Lean variant of explain_cost for hot loops: no cost breakdown and no details
+    buffer.
+
+    Args:
+    - schedule (dict): The schedule to evaluate
+    - assigned_shifts (dict): The shifts assigned to each person
+    - people_data (dict): The people data
+    - shifts_data (dict): The shifts data
+
+    Returns:
+    - float: The total cost of the schedule
+    """
+    individual_costs = []
+    for person_id in people_data["name_dict"]:
+        if person_id not in assigned_shifts:
+            raise_not_found_error(f"Person {person_id} not in assigned shifts")
+
+        individual_costs.append(
+            individual_cost_value(
+                schedule, person_id, assigned_shifts[person_id], people_data, shifts_data
+            )
+        )
+    deviation_individual_cost = sample_stdev(individual_costs)
+
+    total_cost = (
+        +sum(individual_costs)
+        + shift_priority_cost(schedule, shifts_data)
+        + deviation_individual_cost * BALANCE_FACTOR
+        + mixed_gender_dist_cost(schedule, people_data, shifts_data)
+    )
+    if USE_EXPERIENCE_COST:
+        total_cost += mixed_experience_cost(schedule, people_data, shifts_data)
+
+    return total_cost
+
+
+def explain_cost(
+    schedule, assigned_shifts, people_data, shifts_data, print_costs=False
 ):
     """
     Calculate the total cost of the schedule based on individual costs, experience costs
+    and explain how it is composed. Meant for the final schedule and reports.
 
     Args:
     - schedule (dict): The schedule to evaluate
@@ -47,18 +106,17 @@ def cost_function(
     )
 
     # Calculate the mean and standard deviation of individual costs
-    mean_individual_cost = statistics.mean(individual_costs.values())
-    deviation_individual_cost = (
-        statistics.stdev(individual_costs.values()) if len(individual_costs) > 1 else 0
-    )
+    mean_individual_cost = math.fsum(individual_costs.values()) / len(individual_costs)
+    deviation_individual_cost = sample_stdev(individual_costs.values())
 
     # # Introduce a balance factor to penalize high deviation
-    balance_factor = 50  # Adjust this factor as needed
-    individual_balance_cost = deviation_individual_cost * balance_factor
+    individual_balance_cost = deviation_individual_cost * BALANCE_FACTOR
 
     # Calculate mixed experience and gender costs
     gender_cost = mixed_gender_dist_cost(schedule, people_data, shifts_data)
-    # experience_cost = mixed_experience_cost(schedule, people_data, shifts_data)
+    experience_cost = 0
+    if USE_EXPERIENCE_COST:
+        experience_cost = mixed_experience_cost(schedule, people_data, shifts_data)
 
     priority_cost = shift_priority_cost(schedule, shifts_data)
 
@@ -68,37 +126,23 @@ def cost_function(
         + priority_cost
         + individual_balance_cost
         + gender_cost
-        # + experience_cost
+        + experience_cost
     )
-    
 
     output_buffer = StringIO()
-    if print_costs and False:
-        for person in people_data["name_dict"]:
-            output_buffer.write(f"{person}\n")
-            output_buffer.write(f"Total Cost: {individual_costs[person]}\n")
-            # output_buffer.write(f"    Preference Cost: {pref_costs[person]}\n")
-            # output_buffer.write(f"    Off-Day Cost: {off_day_costs[person]}\n")
-            # output_buffer.write(f"    Shift Ranking Cost: {rank_costs[person]}\n")
-            output_buffer.write(f" Cost Breakdown: {total_cost_breakdown[person]}\n")
-        output_buffer.write(f"Total Cost: {total_cost}\n")
-        # output_buffer.write(f"Experience cost: {experience_cost}\n")
-        output_buffer.write(f"Genders cost: {gender_cost}\n")
-        output_buffer.write(
-            f"Sum of Individual Costs: {sum(individual_costs.values())}\n"
-        )
-        output_buffer.write(f"Mean Individual Cost: {mean_individual_cost}\n")
-        output_buffer.write(f"Deviation Individual Cost: {deviation_individual_cost}\n")
-        # output_buffer.write(f"Sum of Off-Day Costs: {sum(off_day_costs)}\n")
-        # output_buffer.write(
-        #     f"No. of people having no off days: {off_day_costs.count(OFF_DAY_FACTOR)}\n"
-        # )
-        # output_buffer.write(f"Sum of Preference Costs: {sum(pref_costs)}\n")
-        # output_buffer.write(f"Sum of Shift Ranking Costs: {sum(rank_costs)}\n")
-        # output_buffer.write(
-        # f"Sum of Shift Type Experience Costs: {sum(shift_type_experience_costs)}\n"
-        # )
-
+    for person in people_data["name_dict"]:
+        output_buffer.write(f"{person}\n")
+        output_buffer.write(f"Total Cost: {individual_costs[person]}\n")
+        output_buffer.write(f" Cost Breakdown: {total_cost_breakdown[person]}\n")
+    output_buffer.write(f"Total Cost: {total_cost}\n")
+    output_buffer.write(f"Priority cost: {priority_cost}\n")
+    output_buffer.write(f"Experience cost: {experience_cost}\n")
+    output_buffer.write(f"Genders cost: {gender_cost}\n")
+    output_buffer.write(f"Sum of Individual Costs: {sum(individual_costs.values())}\n")
+    output_buffer.write(f"Mean Individual Cost: {mean_individual_cost}\n")
+    output_buffer.write(f"Deviation Individual Cost: {deviation_individual_cost}\n")
+
+    if print_costs:
         print(output_buffer.getvalue())
 
     return total_cost, total_cost_breakdown, output_buffer.getvalue()
@@ -164,6 +208,41 @@ def individual_cost(
 
     return individual_costs, cost_breakdown
 
+def individual_cost_value(
+    schedule,
+    person_id,
+    assigned_shifts_person,
+    people_data,
+    shifts_data,
+    assigned_shift_types=None,
+):
+    """
+    Calculate the individual cost of a person without building a cost breakdown.
+
+    The shift type counts of the person can be passed in if they are kept counted.
+    """
+    return (
+        preference_cost(
+            schedule, person_id, assigned_shifts_person, people_data, shifts_data
+        )
+        + off_day_cost(
+            schedule, person_id, assigned_shifts_person, people_data, shifts_data
+        )
+        + time_frame_cost(
+            schedule, person_id, assigned_shifts_person, people_data, shifts_data
+        )
+        + shift_type_cost(
+            schedule,
+            person_id,
+            assigned_shifts_person,
+            people_data,
+            shifts_data,
+            assigned_shift_types,
+        )
+        + check_mandatory(assigned_shifts_person, person_id, people_data, shifts_data)
+    )
+
+
 def check_occurance():
     
     return
@@ -171,59 +250,54 @@ def check_occurance():
 
 def check_mandatory(assigned_shifts_person, person_id, people_data, shifts_data):
     mandatory_periods = people_data["mandatory_dict"].get(person_id, [])
+    if not mandatory_periods:
+        return 0
 
-    # Set to keep track of mandatory periods that have been satisfied
-    satisfied_periods = set()
-
+    # Combine the precomputed masks of the mandatory periods each shift lies within
+    mandatory_masks = people_data["mandatory_mask_dict"].get(person_id, {})
+    satisfied_periods = 0
     for shift_id in assigned_shifts_person:
-        shift_start, shift_end = shifts_data["shift_time_dict"].get(
-            shift_id, (None, None)
-        )
-        if shift_start is None or shift_end is None:
-            continue  # Skip if shift times are not found
-
-        for mandatory_start, mandatory_end in mandatory_periods:
-            if shift_start >= mandatory_start and shift_end <= mandatory_end:
-                satisfied_periods.add((mandatory_start, mandatory_end))
+        satisfied_periods |= mandatory_masks.get(shift_id, 0)
 
     # If all mandatory periods are satisfied, return True
-    if len(satisfied_periods) >= len(mandatory_periods):
+    if bin(satisfied_periods).count("1") >= len(mandatory_periods):
         return 0
 
-    return 5000000
+    return MANDATORY_FACTOR
 
 
 def shift_priority_cost(schedule, shifts_data):
     cost = 0
     for shift_id, shift in schedule.items():
-        shift_priority = shifts_data["shift_priority_dict"].get(shift_id, 1)
-        if len(shift) < shifts_data["shift_capacity_dict"][shift_id][0]:
-            cost += shift_priority**50
+        cost += shift_priority_term(shift_id, shift, shifts_data)
     return cost
 
 
+def shift_priority_term(shift_id, shift, shifts_data):
+    """
+    Calculate the priority penalty of a single shift.
+
+    Args:
+    - shift_id (int): The ID of the shift
+    - shift (list): The people assigned to the shift
+    - shifts_data (dict): The shifts data
+
+    Returns:
+    - int: The penalty if the shift is below its minimum capacity, 0 otherwise
+    """
+    if len(shift) < shifts_data["shift_capacity_dict"][shift_id][0]:
+        return shifts_data["shift_priority_dict"].get(shift_id, 1) ** 50
+    return 0
+
+
 def shift_type_cost(
-    schedule, person_id, assigned_shifts_person, people_data, shifts_data
+    schedule,
+    person_id,
+    assigned_shifts_person,
+    people_data,
+    shifts_data,
+    assigned_shift_types=None,
 ):
-    def retrieve_shift_types(assigned_shifts, shift_type_dict):
-        """
-        Calculate the number of assigned shift types for a person.
-
-        Args:
-        - assigned_shifts (list): List of shifts already assigned to the person.
-        - shift_type_dict (dict): Mapping from shift ID to shift type.
-
-        Returns:
-        - dict: A dictionary with the count of each shift type assigned to the person.
-        """
-        assigned_shift_types = {}
-        for assigned_shift in assigned_shifts:
-            assigned_shift_type = shift_type_dict.get(assigned_shift, 0)
-            assigned_shift_types[assigned_shift_type] = (
-                assigned_shift_types.get(assigned_shift_type, 0) + 1
-            )
-        return assigned_shift_types
-
     # If person_shift_types is empty, act as a "joker" and don't apply any penalties
     person_shift_types = people_data["people_shift_types_dict"].get(person_id, {})
     if not person_shift_types:
@@ -231,10 +305,12 @@ def shift_type_cost(
 
     cost = 0
 
-    # Calculate the number of each shift type already assigned to the person
-    assigned_shift_types = retrieve_shift_types(
-        assigned_shifts_person, shifts_data["shift_type_dict"]
-    )
+    # Calculate the number of each shift type already assigned to the person,
+    # unless the caller keeps them counted (see AssignmentCounters)
+    if assigned_shift_types is None:
+        assigned_shift_types = count_shift_types(
+            assigned_shifts_person, shifts_data["shift_type_dict"]
+        )
 
     # Apply penalties based on shift type preferences
     for person_shift_type, (_, min_required, max_allowed) in person_shift_types.items():
@@ -263,8 +339,8 @@ def preference_cost(
     shifts_data,
     same_shift_friend_factor=1,
     same_shift_enemy_factor=1,
-    same_time_friend_factor=0.75,
-    same_time_enemy_factor=0.75,
+    same_time_friend_factor=SAME_TIME_FACTOR,
+    same_time_enemy_factor=SAME_TIME_FACTOR,
     friend_factor=FRIEND_FACTOR,
     enemy_factor=ENEMY_FACTOR,
 ):
@@ -272,30 +348,40 @@ def preference_cost(
     enemies_count = 0
     preference_cost = 0
 
-    preferences = people_data["preference_dict"].get(person_id, [])
     shift_times = shifts_data["shift_time_dict"]
-    friend_set = {preference[0] for preference in preferences if preference[1] < 0}
-    enemy_set = {preference[0] for preference in preferences if preference[1] > 0}
+    friend_set = people_data["friend_dict"].get(person_id, frozenset())
+    enemy_set = people_data["enemy_dict"].get(person_id, frozenset())
+
+    if not friend_set and not enemy_set:
+        return preference_cost  # Nobody to match against
+
+    assigned_shift_set = set(assigned_shifts_person)
 
     # Convert assigned shifts to a set of start times
-    assigned_times = {shift_times[shift][0] for shift in assigned_shifts_person}
+    assigned_times = {shift_times[shift][0] for shift in assigned_shift_set}
 
     total_possible_matches = len(friend_set) * len(assigned_shifts_person)
 
-    # Iterate through assigned shifts
-    for shift_id, colleagues in schedule.items():
-        shift_start_time = shift_times[shift_id][0]
-        for colleague_id in colleagues:
+    # Count the colleagues working the same shifts as the person
+    for shift_id in assigned_shift_set:
+        for colleague_id in schedule[shift_id]:
             if person_id != colleague_id:
                 if colleague_id in friend_set:
-                    if shift_id in assigned_shifts_person:
-                        friends_count += same_shift_friend_factor
-                    elif shift_start_time in assigned_times:
-                        friends_count += same_time_friend_factor
+                    friends_count += same_shift_friend_factor
                 if colleague_id in enemy_set:
-                    if shift_id in assigned_shifts_person:
-                        enemies_count += same_shift_enemy_factor
-                    elif shift_start_time in assigned_times:
+                    enemies_count += same_shift_enemy_factor
+
+    # Count the colleagues working other shifts starting at the same time
+    shift_start_time_dict = shifts_data["shift_start_time_dict"]
+    for shift_start_time in assigned_times:
+        for shift_id in shift_start_time_dict[shift_start_time]:
+            if shift_id in assigned_shift_set:
+                continue
+            for colleague_id in schedule[shift_id]:
+                if person_id != colleague_id:
+                    if colleague_id in friend_set:
+                        friends_count += same_time_friend_factor
+                    if colleague_id in enemy_set:
                         enemies_count += same_time_enemy_factor
 
     # Calculate the cost for each potential deviation from the preference
@@ -314,31 +400,13 @@ def off_day_cost(
     shifts_data,
     off_day_factor=OFF_DAY_FACTOR,
 ):
-    off_day_cost = 0
-    unavailability_periods = people_data["off_shifts_dict"].get(person_id, [])
-    shift_times = shifts_data["shift_time_dict"]
+    # Count the assigned shifts overlapping a day off (precomputed per person and shift)
+    off_day_count = people_data["off_day_matrix"][
+        people_data["person_index_dict"][person_id],
+        shift_columns(assigned_shifts_person, shifts_data),
+    ].sum()
 
-    for shift_id in assigned_shifts_person:
-        start, end = shift_times.get(shift_id, (None, None))
-        if start is None or end is None:
-            continue  # Skip if shift times are not found
-
-        for unavailability_start, unavailability_end in unavailability_periods:
-            if (
-                start
-                <= unavailability_start
-                < end  # Unavailability starts during the shift
-                or start
-                < unavailability_end
-                <= end  # Unavailability ends during the shift
-                or (
-                    unavailability_start <= start and unavailability_end >= end
-                )  # Unavailability spans the entire shift
-            ):
-                off_day_cost += off_day_factor
-                break  # Break to avoid multiple increments for the same shift
-
-    return off_day_cost
+    return float(off_day_count) * off_day_factor
 
 
 def time_frame_cost(
@@ -349,62 +417,24 @@ def time_frame_cost(
     shifts_data,
     ranking_factor=SHIFT_RANKING_FACTOR,
 ):
-    time_frame_cost = 0
-
-    # General shift costs from shifts_data
-    shift_costs = shifts_data["shift_cost_dict"]
-
-    avg_shift_cost = 0
-
-    if len(shift_costs) > 0:
-        ## calc avg shift cost for all shifts
-        avg_shift_cost = sum(shift_costs.values()) / len(shift_costs)
-
-    ## expected cost for a person with 4 shifts
-    expected_cost = avg_shift_cost * DEFAULT_MIN_AMOUNT_SHIFT
+    # Sum the general shift costs and squared preference costs (precomputed per person and shift)
+    time_frame_cost = (
+        float(
+            people_data["shift_preference_cost_matrix"][
+                people_data["person_index_dict"][person_id],
+                shift_columns(assigned_shifts_person, shifts_data),
+            ].sum()
+        )
+        * ranking_factor
+    )
 
+    # Count the night shifts (precomputed per shift)
+    shift_attribute_dict = shifts_data["shift_attribute_dict"]
     night_shift_count = 0
-
     for shift_id in assigned_shifts_person:
-
-        # Retrieve personal shift preferences for the person
-        personal_shift_preference = people_data["shift_preference_dict"].get(
-            person_id, []
-        )
-
-        # Get shift start and end times
-        shift_start, shift_end = shifts_data["shift_time_dict"].get(
-            shift_id, (None, None)
-        )
-
-        # Convert shift start and end times to seconds since midnight
-        shift_start_sec = time_to_seconds_since_midnight(shift_start)
-        shift_end_sec = time_to_seconds_since_midnight(shift_end)
-
-        # check if the shift is a night shift
-        if shift_start_sec >= time_to_seconds_since_midnight(
-            time(22, 0, 0)
-        ) or shift_end_sec <= time_to_seconds_since_midnight(time(7, 0, 0)):
+        if shift_attribute_dict[shift_id]["is_night"]:
             night_shift_count += 1
 
-        # Initialize preference cost for the shift
-        preference_cost = 0
-
-        # Find the preference cost for the shift
-        for pref_times, cost in personal_shift_preference:
-            for pref_start, pref_end in pref_times:
-                if (shift_start_sec >= pref_start and shift_end_sec <= pref_end) or (
-                    shift_start_sec <= pref_start and shift_end_sec >= pref_end
-                ):
-
-                    preference_cost = cost
-                    break
-
-        # Add the squared preference cost multiplied by the general shift cost
-        time_frame_cost += (
-            shift_costs.get(shift_id, 0) + (preference_cost**2)
-        ) * ranking_factor
-
     if night_shift_count > 1:
         time_frame_cost += (
             len(assigned_shifts_person) / night_shift_count
@@ -413,22 +443,39 @@ def time_frame_cost(
     return time_frame_cost
 
 
+def shift_columns(assigned_shifts_person, shifts_data):
+    """
+    Map the shifts of a person to their column in the person x shift matrices.
+
+    Args:
+    - assigned_shifts_person (list): The shifts assigned to the person
+    - shifts_data (dict): The shifts data
+
+    Returns:
+    - list: The column index of every assigned shift
+    """
+    shift_index_dict = shifts_data["shift_index_dict"]
+    return [shift_index_dict[shift_id] for shift_id in assigned_shifts_person]
+
+
 def mixed_experience_cost(
     schedule,
     people_data,
     shifts_data,
     experience_factor=EXPERIENCE_FACTOR,
 ):
-    total_experience_cost = []
-
-    for shift_id, shift in schedule.items():
-        shift_experience = 0
-        for person_id in shift:
-            shift_experience += people_data["experience_dict"][person_id]
-        shift_experience /= len(shift)
-        total_experience_cost.append(shift_experience)
+    if not people_data.get("experience_dict"):
+        return 0
 
-    experience_deviation = statistics.stdev(total_experience_cost)
+    shift_experiences = (
+        shift_average(shift, people_data["experience_dict"])
+        for shift in schedule.values()
+    )
+    experience_deviation = sample_stdev(
+        shift_experience
+        for shift_experience in shift_experiences
+        if shift_experience is not None
+    )
 
     mixed_experience_cost = experience_deviation * experience_factor
     return mixed_experience_cost
@@ -440,21 +487,65 @@ def mixed_gender_dist_cost(
     shifts_data,
     gender_dist_factor=GENDER_DISTRIBUTION_FACTOR,
 ):
-    total_gender_dist_cost = []
-
     if people_data["gender_dict"] is None or people_data["gender_dict"] == {}:
         return 0
 
-    for shift_id, shift in schedule.items():
-        shift_gender_dist = 0
-        for person_id in shift:
-            if people_data["gender_dict"][person_id] is not None:
-                shift_gender_dist += people_data["gender_dict"][person_id]
-        if len(shift) > 0:
-            shift_gender_dist /= len(shift)
-            total_gender_dist_cost.append(shift_gender_dist)
-
-    gender_dist_deviation = statistics.stdev(total_gender_dist_cost)
+    shift_gender_dists = (
+        shift_average(shift, people_data["gender_dict"]) for shift in schedule.values()
+    )
+    gender_dist_deviation = sample_stdev(
+        shift_gender_dist
+        for shift_gender_dist in shift_gender_dists
+        if shift_gender_dist is not None
+    )
 
     gender_dist_cost = gender_dist_deviation * gender_dist_factor
     return gender_dist_cost
+
+
+def shift_average(shift, value_dict):
+    """
+    Calculate the average value (e.g. gender or experience) of the people assigned to a shift.
+
+    Args:
+    - shift (list): The people assigned to the shift
+    - value_dict (dict): Mapping from person ID to value
+
+    Returns:
+    - float: The average value, or None if the shift is empty
+    """
+    if len(shift) == 0:
+        return None
+
+    shift_value = 0
+    for person_id in shift:
+        if value_dict.get(person_id) is not None:
+            shift_value += value_dict[person_id]
+    return shift_value / len(shift)
+
+
+def sample_stdev(values):
+    """
+    Calculate the sample standard deviation in a single pass with plain floats.
+
+    The statistics module computes with exact fractions, which is far too slow
+    for the cost function. Welford's update avoids materialising the values.
+
+    Args:
+    - values (iterable): The values
+
+    Returns:
+    - float: The sample standard deviation, 0 for less than two values
+    """
+    count = 0
+    mean = 0.0
+    squared_deviation = 0.0
+    for value in values:
+        count += 1
+        delta = value - mean
+        mean += delta / count
+        squared_deviation += delta * (value - mean)
+
+    if count < 2:
+        return 0
+    return math.sqrt(squared_deviation / (count - 1))
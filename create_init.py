@@ -11,6 +11,8 @@ from error_handling import (
 )
 
 from hard_constraints import is_valid_assignment
+from assignment_counters import AssignmentCounters, count_shift_types
+from cancellation import is_cancelled
 
 
 DEFAULT_MIN_AMOUNT_SHIFT = 4
@@ -69,13 +71,17 @@ def check_total_capacity(people_data, shifts_data):
     )
 
 
-def generate_initial_solution(shifts_data, people_data):
+def generate_initial_solution(
+    shifts_data, people_data, cancel_token=None, deadline=None
+):
     """
     Generate an initial solution for the schedule by assigning shifts to people.
 
     Args:
     - shifts_data (dict): Data about shifts including capacities and priorities.
     - people_data (dict): Data about people including their preferences and capacities.
+    - cancel_token (CancellationToken): Stops the creation early if cancelled.
+    - deadline (float): A time.time() timestamp that stops the creation early once passed.
 
     Returns:
     - dict: The final schedule after attempting to assign shifts to all people, or None if unsuccessful.
@@ -92,6 +98,8 @@ def generate_initial_solution(shifts_data, people_data):
             schedule,
             people_data,
             shifts_data,
+            cancel_token=cancel_token,
+            deadline=deadline,
         )
 
         logging.info(
@@ -100,8 +108,12 @@ def generate_initial_solution(shifts_data, people_data):
 
         # Check if a valid schedule was generated
         if schedule:
-            logging.info(f"Solution generated successfully: {schedule}")
-            logging.info(f"Assigned shifts: {assigned_shifts}")
+            logging.info(
+                f"Solution generated successfully for {len(schedule)} shifts"
+            )
+            # The full dicts are only formatted if debug logging is enabled
+            logging.debug("Solution: %s", schedule)
+            logging.debug("Assigned shifts: %s", assigned_shifts)
         else:
             logging.error("Failed to generate a valid initial solution...")
 
@@ -139,7 +151,13 @@ def is_not_already_assigned(shift_id, schedule, person_id):
 
 
 def choose_shift(
-    schedule, person_id, assigned_shifts, people_data, shifts_data, factor=1
+    schedule,
+    person_id,
+    assigned_shifts,
+    people_data,
+    shifts_data,
+    factor=1,
+    counters=None,
 ):
     """
     Choose a shift for a person based on their preferences and the current schedule.
@@ -150,31 +168,12 @@ def choose_shift(
     - assigned_shifts (list): List of shifts already assigned to the person.
     - people_data (dict): Data about people including their preferences and capacities.
     - shifts_data (dict): Data about shifts including capacities and priorities.
+    - counters (AssignmentCounters): The counters of the schedule, if maintained.
 
     Returns:
     - str: The ID of the chosen shift.
     """
 
-    def calculate_assigned_shift_types(assigned_shifts, shift_type_dict):
-        """
-        Calculate the number of assigned shift types for a person.
-
-        Args:
-        - assigned_shifts (list): List of shifts already assigned to the person.
-        - shift_type_dict (dict): Mapping from shift ID to shift type.
-
-        Returns:
-        - dict: A dictionary with the count of each shift type assigned to the person.
-        """
-        assigned_shift_types = {}
-        for assigned_shift in assigned_shifts:
-            assigned_shift_type = shift_type_dict.get(assigned_shift, 0)
-            if assigned_shift_type in assigned_shift_types:
-                assigned_shift_types[assigned_shift_type] += 1
-            else:
-                assigned_shift_types[assigned_shift_type] = 1
-        return assigned_shift_types
-
     # Validate inputs
     if person_id not in people_data["people_shift_types_dict"]:
         raise ValueError(f"Person ID {person_id} not found in people data.")
@@ -189,9 +188,12 @@ def choose_shift(
     person_shift_types = people_data["people_shift_types_dict"].get(person_id, {})
 
     # Calculate the number of each shift type already assigned to the person
-    assigned_shift_types = calculate_assigned_shift_types(
-        assigned_shifts, shifts_data["shift_type_dict"]
-    )
+    if counters is not None:
+        assigned_shift_types = counters.assigned_shift_types(person_id)
+    else:
+        assigned_shift_types = count_shift_types(
+            assigned_shifts, shifts_data["shift_type_dict"]
+        )
 
     # Filter shifts based on the following criteria:
     # 1. Exclude shifts that exceed their maximum capacity, unless the capacity is unlimited.
@@ -290,7 +292,13 @@ def choose_shift(
 
 
 def assign_shifts_person(
-    assigned_shifts_history, schedule, person_id, people_data, shifts_data, attempt
+    assigned_shifts_history,
+    schedule,
+    person_id,
+    people_data,
+    shifts_data,
+    attempt,
+    counters=None,
 ):
     """
     Recursively assign shifts to a person based on their preferences and capacities.
@@ -301,6 +309,7 @@ def assign_shifts_person(
         person_id (int/float): The ID of the person to assign shifts to.
         people_data (dict): Data about people including their preferences and capacities.
         shifts_data (dict): Data about shifts including capacities and priorities.
+        counters (AssignmentCounters): The counters of the schedule, updated alongside.
 
     Returns:
         tuple: Updated schedule, updated assigned shifts history.
@@ -327,6 +336,7 @@ def assign_shifts_person(
             people_data,
             shifts_data,
             iteration,
+            counters,
         )
 
         # If no valid shift is found, break and retry
@@ -339,6 +349,8 @@ def assign_shifts_person(
         # Temporarily assign the person to the shift
         schedule[shift_id].append(person_id)
         assigned_shifts_history.append(shift_id)
+        if counters is not None:
+            counters.assign(person_id, shift_id)
 
         # Validate the assignment
         if not is_valid_assignment(
@@ -348,15 +360,20 @@ def assign_shifts_person(
             assigned_shifts_history,
             people_data,
             shifts_data,
+            counters,
         ):
             schedule[shift_id].remove(person_id)
             assigned_shifts_history.remove(shift_id)
+            if counters is not None:
+                counters.unassign(person_id, shift_id)
 
         iteration += 1  # Always increment iteration
 
     if len(assigned_shifts_history) < person_capacity:
         for shift_id in assigned_shifts_history:
             schedule[shift_id].remove(person_id)
+            if counters is not None:
+                counters.unassign(person_id, shift_id)
         # If both attempts fail, raise an error
         raise_invalid_assignment_error(
             f"Person {person_id} could not be assigned all required shifts after {iteration - 1} iterations. (attempt {attempt}) "
@@ -371,7 +388,14 @@ def assign_shifts_person(
         return schedule, assigned_shifts_history
 
 
-def create_schedule(schedule, people_data, shifts_data, max_backtracks=200):
+def create_schedule(
+    schedule,
+    people_data,
+    shifts_data,
+    max_backtracks=200,
+    cancel_token=None,
+    deadline=None,
+):
     """
     Create a schedule by assigning shifts to people based on provided data.
 
@@ -379,6 +403,8 @@ def create_schedule(schedule, people_data, shifts_data, max_backtracks=200):
     - schedule (dict): The initial empty or partially filled schedule.
     - people_data (dict): Data about people including their preferences and capacities.
     - shifts_data (dict): Data about shifts including capacities and priorities.
+    - cancel_token (CancellationToken): Raises a ScheduleCreationError once cancelled.
+    - deadline (float): A time.time() timestamp after which a ScheduleCreationError is raised.
 
     Returns:
     - dict: The final schedule after attempting to assign shifts to all people.
@@ -396,11 +422,19 @@ def create_schedule(schedule, people_data, shifts_data, max_backtracks=200):
     check_shift_type_capacity(people_data, shifts_data)
     check_total_capacity(people_data, shifts_data)
 
+    # Keep the shift members and shift type counts up to date while assigning
+    counters = AssignmentCounters(schedule, people_data, shifts_data)
+
     start_time = time.time()
     attempts = 20  # Allow two attempts to assign shifts
     prev_iteration_time = start_time
 
     while people:
+        if is_cancelled(cancel_token):
+            raise_schedule_creation_error("Schedule creation was cancelled.")
+        if deadline is not None and time.time() >= deadline:
+            raise_schedule_creation_error("Schedule creation ran out of time.")
+
         prev_iteration_time = showInitProgressIndicator(
             len(people), no_of_people, start_time, prev_iteration_time
         )
@@ -421,6 +455,7 @@ def create_schedule(schedule, people_data, shifts_data, max_backtracks=200):
                     people_data,
                     shifts_data,
                     attempt,
+                    counters,
                 )
                 success = True
                 break  # Break if successful
@@ -448,6 +483,7 @@ def create_schedule(schedule, people_data, shifts_data, max_backtracks=200):
                     last_person, last_assignments = change_stack.pop()
                     for shift_id in last_assignments:
                         schedule[shift_id].remove(last_person)
+                        counters.unassign(last_person, shift_id)
                     del assigned_shifts[last_person]
                     people.append(last_person)  # Re-add last person to the queue
              
@@ -458,6 +494,7 @@ def create_schedule(schedule, people_data, shifts_data, max_backtracks=200):
                 )
             else:
                 schedule = {shift_id: [] for shift_id in schedule}
+                counters = AssignmentCounters(schedule, people_data, shifts_data)
                 assigned_shifts = {}
                 people = list(people_data["name_dict"].keys())
                 random.shuffle(people)
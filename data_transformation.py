@@ -1,9 +1,19 @@
 from datetime import datetime, timezone, timedelta, time
+from bisect import bisect_right
+import numpy as np
 
 
 NUM_OF_SHIFTS_PER_PERSON = 5
 NUM_OF_SHIFTS_PER_SV = 2
 
+# Preference flags: friends are listed with a negative flag, enemies with a positive one
+FRIEND_FLAG = -1
+ENEMY_FLAG = 1
+
+# A shift starting after NIGHT_SHIFT_START or ending before NIGHT_SHIFT_END is a night shift
+NIGHT_SHIFT_START = time(22, 0, 0)
+NIGHT_SHIFT_END = time(7, 0, 0)
+
 
 create_dict_from_list = lambda data: {id: value for id, value in data}
 
@@ -188,8 +198,11 @@ def transform_shift_preference_data(shift_preference_data):
 def transform_people_data(people_data):
     person_capacity_dict = create_dict_from_list(people_data["capacity_data"])
     people_shift_types_dict = create_dict_from_list(people_data["shift_types_data"])
+    name_dict = create_dict_from_list(people_data["name_data"])
+    preference_dict = create_dict_from_list(people_data["preference_data"])
     people_transformed_data = {
-        "name_dict": create_dict_from_list(people_data["name_data"]),
+        "name_dict": name_dict,
+        "person_index_dict": create_index_dict(name_dict),
         "person_capacity_dict": person_capacity_dict,
         "unavailability_dict": create_dict_from_list(
             transform_times_data(people_data["unavailability_data"])
@@ -201,11 +214,13 @@ def transform_people_data(people_data):
             transform_times_data(people_data["day_off_data"])
         ),
         "gender_dict": create_dict_from_list(people_data["gender_data"]),
-        # "experience_dict": create_dict_from_list(people_data["experience_data"]),
+        "experience_dict": create_dict_from_list(people_data.get("experience_data", [])),
         "minimum_break_dict": create_dict_from_list(
             convert_time(people_data["minimum_break_data"])
         ),
-        "preference_dict": create_dict_from_list(people_data["preference_data"]),
+        "preference_dict": preference_dict,
+        "friend_dict": create_colleague_dict(preference_dict, FRIEND_FLAG),
+        "enemy_dict": create_colleague_dict(preference_dict, ENEMY_FLAG),
         "people_shift_types_dict": people_shift_types_dict,
         "shift_preference_dict": create_dict_from_list(
             transform_shift_preference_data(people_data["shift_preference_data"])
@@ -218,13 +233,94 @@ def transform_people_data(people_data):
     return people_transformed_data
 
 
+def create_colleague_dict(preference_dict, flag_sign):
+    """
+    Collect the colleagues each person has listed as friend or enemy.
+
+    Args:
+        preference_dict (dict): Mapping from person ID to a list of (person ID, flag) tuples.
+        flag_sign (int): FRIEND_FLAG to collect the friends, ENEMY_FLAG to collect the enemies.
+
+    Returns:
+        dict: A dictionary mapping each person to the frozenset of matching colleagues.
+    """
+    return {
+        person: frozenset(
+            colleague for colleague, flag in preferences if flag * flag_sign > 0
+        )
+        for person, preferences in preference_dict.items()
+    }
+
+
+def create_index_dict(data_dict):
+    """
+    Assign a consecutive row/column index to every key of a dictionary.
+
+    Args:
+        data_dict (dict): A dictionary keyed by person or shift ID.
+
+    Returns:
+        dict: A dictionary mapping each key to its index.
+    """
+    return {key: index for index, key in enumerate(data_dict)}
+
+
+def create_start_time_index(shift_time_dict):
+    """
+    Group the shifts by their start time.
+
+    Args:
+        shift_time_dict (dict): A dictionary mapping shifts to their (start, end) timestamps.
+
+    Returns:
+        dict: A dictionary mapping each start timestamp to the list of shifts starting then.
+    """
+    start_time_index = {}
+
+    for shift, (start, _) in shift_time_dict.items():
+        start_time_index.setdefault(start, []).append(shift)
+
+    return start_time_index
+
+
+def create_shift_attribute_dict(shift_time_dict):
+    """
+    Precompute the time attributes of every shift.
+
+    Args:
+        shift_time_dict (dict): A dictionary mapping shifts to their (start, end) timestamps.
+
+    Returns:
+        dict: A dictionary mapping each shift to a dictionary with:
+            - "start_sec"/"end_sec": Start and end in seconds since midnight.
+            - "is_night": Whether the shift is a night shift.
+    """
+    night_start_sec = time_to_seconds_since_midnight(NIGHT_SHIFT_START)
+    night_end_sec = time_to_seconds_since_midnight(NIGHT_SHIFT_END)
+
+    shift_attribute_dict = {}
+    for shift, (start, end) in shift_time_dict.items():
+        start_sec = time_to_seconds_since_midnight(start)
+        end_sec = time_to_seconds_since_midnight(end)
+        shift_attribute_dict[shift] = {
+            "start_sec": start_sec,
+            "end_sec": end_sec,
+            "is_night": start_sec >= night_start_sec or end_sec <= night_end_sec,
+        }
+
+    return shift_attribute_dict
+
+
 def transform_shifts_data(shifts_data):
     shift_type_dict = create_dict_from_list(shifts_data["shift_type_data"])
     shift_capacity_dict = create_dict_from_list(shifts_data["shift_capacity_data"])
+    shift_time_dict = create_dict_from_list(
+        convert_datetimes(shifts_data["shift_time_data"])
+    )
     shifts_transformed_data = {
-        "shift_time_dict": create_dict_from_list(
-            convert_datetimes(shifts_data["shift_time_data"])
-        ),
+        "shift_time_dict": shift_time_dict,
+        "shift_start_time_dict": create_start_time_index(shift_time_dict),
+        "shift_index_dict": create_index_dict(shift_time_dict),
         "shift_capacity_dict": shift_capacity_dict,
         "shift_type_dict": shift_type_dict,
         "restrict_shift_type_dict": create_dict_from_list(
@@ -234,12 +330,246 @@ def transform_shifts_data(shifts_data):
             shifts_data["shift_priority_data"]
         ),
         "shift_cost_dict": create_dict_from_list(shifts_data["shift_cost_data"]),
+        "shift_attribute_dict": create_shift_attribute_dict(shift_time_dict),
         "total_capacity": calculate_total_shift_capacity(shift_type_dict, shift_capacity_dict),
     }
 
     return shifts_transformed_data
 
 
+def create_period_index(periods):
+    """
+    Merge overlapping periods and sort them for bisect based overlap queries.
+
+    Args:
+        periods (list): A list of (start, end) timestamps in any order.
+
+    Returns:
+        tuple: The sorted starts and ends of the merged, non-overlapping periods.
+    """
+    starts = []
+    ends = []
+
+    for period_start, period_end in sorted(periods):
+        if ends and period_start < ends[-1]:
+            ends[-1] = max(ends[-1], period_end)  # Overlaps the previous period
+        else:
+            starts.append(period_start)
+            ends.append(period_end)
+
+    return starts, ends
+
+
+def period_index_overlaps(period_index, shift_start, shift_end):
+    """
+    Check whether a shift overlaps any period of a period index in O(log n).
+
+    Args:
+        period_index (tuple): The output of create_period_index.
+        shift_start (int): Start timestamp of the shift.
+        shift_end (int): End timestamp of the shift.
+
+    Returns:
+        bool: True if a period starts before the shift ends and ends after it starts.
+    """
+    starts, ends = period_index
+    # The merged periods are disjoint, so the ends are sorted as well
+    position = bisect_right(ends, shift_start)
+    return position < len(starts) and starts[position] < shift_end
+
+
+def mandatory_period_mask(shift_start, shift_end, mandatory_periods):
+    """
+    Find the mandatory periods a shift lies within.
+
+    Args:
+        shift_start (int): Start timestamp of the shift.
+        shift_end (int): End timestamp of the shift.
+        mandatory_periods (list): The distinct (start, end) periods, sorted by start.
+
+    Returns:
+        int: A bitmask with bit i set if the shift lies within mandatory period i.
+    """
+    mask = 0
+
+    for position, (mandatory_start, mandatory_end) in enumerate(mandatory_periods):
+        if mandatory_start > shift_start:
+            break  # The remaining periods start after the shift
+        if shift_end <= mandatory_end:
+            mask |= 1 << position
+
+    return mask
+
+
+def create_break_masks(shift_time_dict, minimum_break):
+    """
+    Map every shift to a bitmask over a discretized timeline, padded by a minimum break.
+
+    Each shift covers [start, end + minimum_break). The timeline is cut at every start
+    and padded end, so two shifts are closer than the minimum break (or overlap)
+    exactly if their masks share a bit.
+
+    Args:
+        shift_time_dict (dict): A dictionary mapping shifts to their (start, end) timestamps.
+        minimum_break (int): The minimum break after a shift in seconds.
+
+    Returns:
+        dict: A dictionary mapping each shift to its bitmask.
+    """
+    timeline = sorted(
+        {start for start, _ in shift_time_dict.values()}
+        | {end + minimum_break for _, end in shift_time_dict.values()}
+    )
+    position_dict = {point: position for position, point in enumerate(timeline)}
+
+    break_masks = {}
+    for shift, (start, end) in shift_time_dict.items():
+        first = position_dict[start]
+        last = position_dict[end + minimum_break]
+        break_masks[shift] = ((1 << last) - 1) ^ ((1 << first) - 1)
+
+    return break_masks
+
+
+def shift_time_preference(shift_start_sec, shift_end_sec, personal_shift_preference):
+    """
+    Find the preference cost a person has given to the time frame of a shift.
+
+    Args:
+        shift_start_sec (int): Start of the shift in seconds since midnight.
+        shift_end_sec (int): End of the shift in seconds since midnight.
+        personal_shift_preference (list): A list of ([(start, end), ...], cost) tuples.
+
+    Returns:
+        int: The cost of the last matching preference, 0 if none matches.
+    """
+    preference_cost = 0
+
+    for pref_times, cost in personal_shift_preference:
+        for pref_start, pref_end in pref_times:
+            if (shift_start_sec >= pref_start and shift_end_sec <= pref_end) or (
+                shift_start_sec <= pref_start and shift_end_sec >= pref_end
+            ):
+                preference_cost = cost
+                break
+
+    return preference_cost
+
+
+def transform_person_shift_data(people_transformed_data, shifts_transformed_data):
+    """
+    Precompute the cost terms that only depend on a (person, shift) pair.
+
+    These never change during a run, so the cost functions gather them from dense
+    person x shift matrices (rows follow person_index_dict, columns follow
+    shift_index_dict) instead of comparing time intervals on every call.
+
+    Args:
+        people_transformed_data (dict): The output of transform_people_data.
+        shifts_transformed_data (dict): The output of transform_shifts_data.
+
+    Returns:
+        dict: The people data extended with:
+            - "shift_preference_cost_matrix": general shift cost plus squared shift preference cost.
+            - "off_day_matrix": 1 if the shift overlaps a day off of the person, 0 otherwise.
+            - "mandatory_mask_dict": For each person, the shifts that lie within one of their
+              mandatory periods and the bitmask of those periods (see mandatory_period_mask).
+            - "eligible_shifts_dict": The shifts each person may work at all, ordered by column.
+            - "eligible_shift_mask_dict": The same as a bitset over the shift columns.
+            - "break_mask_dict": For each person, the break masks of all shifts padded by
+              their minimum break (see create_break_masks). People with the same minimum
+              break share the same dictionary.
+    """
+    person_index_dict = people_transformed_data["person_index_dict"]
+    shift_index_dict = shifts_transformed_data["shift_index_dict"]
+    shift_time_dict = shifts_transformed_data["shift_time_dict"]
+    shift_cost_dict = shifts_transformed_data["shift_cost_dict"]
+
+    shift_preference_cost_matrix = np.zeros((len(person_index_dict), len(shift_index_dict)))
+    off_day_matrix = np.zeros((len(person_index_dict), len(shift_index_dict)))
+
+    mandatory_mask_dict = {}
+    eligible_shifts_dict = {}
+    eligible_shift_mask_dict = {}
+
+    shift_type_dict = shifts_transformed_data["shift_type_dict"]
+    restrict_shift_type_dict = shifts_transformed_data["restrict_shift_type_dict"]
+
+    # The break masks only depend on the minimum break, so build them once per value
+    break_masks_by_break = {}
+    break_mask_dict = {}
+    for person in person_index_dict:
+        minimum_break = people_transformed_data["minimum_break_dict"].get(person, 0)
+        if minimum_break not in break_masks_by_break:
+            break_masks_by_break[minimum_break] = create_break_masks(
+                shift_time_dict, minimum_break
+            )
+        break_mask_dict[person] = break_masks_by_break[minimum_break]
+
+    shift_attribute_dict = shifts_transformed_data["shift_attribute_dict"]
+
+    for person, row in person_index_dict.items():
+        personal_shift_preference = people_transformed_data["shift_preference_dict"].get(
+            person, []
+        )
+        off_period_index = create_period_index(
+            people_transformed_data["off_shifts_dict"].get(person, [])
+        )
+        unavailability_index = create_period_index(
+            people_transformed_data["unavailability_dict"].get(person, [])
+        )
+        mandatory_periods = sorted(
+            set(people_transformed_data["mandatory_dict"].get(person, []))
+        )
+        person_shift_types = people_transformed_data["people_shift_types_dict"].get(
+            person, []
+        )
+        mandatory_masks = {}
+        eligible_shifts = []
+        eligible_shift_mask = 0
+
+        for shift, column in shift_index_dict.items():
+            preference_cost = shift_time_preference(
+                shift_attribute_dict[shift]["start_sec"],
+                shift_attribute_dict[shift]["end_sec"],
+                personal_shift_preference,
+            )
+            shift_preference_cost_matrix[row, column] = (
+                shift_cost_dict.get(shift, 0) + preference_cost**2
+            )
+
+            shift_start, shift_end = shift_time_dict[shift]
+            if period_index_overlaps(off_period_index, shift_start, shift_end):
+                off_day_matrix[row, column] = 1
+
+            mask = mandatory_period_mask(shift_start, shift_end, mandatory_periods)
+            if mask:
+                mandatory_masks[shift] = mask
+
+            # Restricted shifts may only be worked by people with the shift type
+            restricted = (
+                restrict_shift_type_dict.get(shift)
+                and shift_type_dict.get(shift) not in person_shift_types
+            )
+            if not restricted and not period_index_overlaps(
+                unavailability_index, shift_start, shift_end
+            ):
+                eligible_shifts.append(shift)
+                eligible_shift_mask |= 1 << column
+
+        mandatory_mask_dict[person] = mandatory_masks
+        eligible_shifts_dict[person] = tuple(eligible_shifts)
+        eligible_shift_mask_dict[person] = eligible_shift_mask
+
+    people_transformed_data["shift_preference_cost_matrix"] = shift_preference_cost_matrix
+    people_transformed_data["off_day_matrix"] = off_day_matrix
+    people_transformed_data["mandatory_mask_dict"] = mandatory_mask_dict
+    people_transformed_data["eligible_shifts_dict"] = eligible_shifts_dict
+    people_transformed_data["eligible_shift_mask_dict"] = eligible_shift_mask_dict
+    people_transformed_data["break_mask_dict"] = break_mask_dict
+
+    return people_transformed_data
+
 
 def create_total_friends_array(preference_list):
     total_friends_array = {}
@@ -1,4 +1,5 @@
 from logger import logging
+from tracing import tracer
 
 
 class CapacityError(Exception):
@@ -25,11 +26,13 @@ class NotFoundError(Exception):
 
 def raise_not_found_error(message):
     """Log and raise a not found error with the given message."""
+    tracer.flush()  # Write the recent trace events leading up to the error first
     logging.error(message)
     raise NotFoundError(message)
 
 def raise_capacity_error(message):
     """Log and raise a capacity error with the given message."""
+    tracer.flush()  # Write the recent trace events leading up to the error first
     logging.fatal(message)
     raise CapacityError(message)
 
@@ -42,5 +45,6 @@ def raise_invalid_assignment_error(message):
 
 def raise_schedule_creation_error(message):
     """Log and raise a schedule creation error with the given message."""
+    tracer.flush()  # Write the recent trace events leading up to the error first
     logging.fatal(message)
     raise ScheduleCreationError(message)
@@ -1,7 +1,7 @@
 import random
 import time
-import copy
-from logger import logging
+from tracing import tracer
+from assignment_counters import count_shift_types
 
 
 def get_random_element(d, weights=None):
@@ -25,7 +25,13 @@ def get_random_element(d, weights=None):
 
 
 def is_valid_assignment(
-    schedule, new_shift_id, person_id, assigned_shifts_person, people_data, shifts_data
+    schedule,
+    new_shift_id,
+    person_id,
+    assigned_shifts_person,
+    people_data,
+    shifts_data,
+    counters=None,
 ):
     """
     Check if assigning a person to a new shift is valid based on various criteria.
@@ -37,37 +43,19 @@ def is_valid_assignment(
     - assigned_shifts_person (list): List of shifts already assigned to the person.
     - people_data (dict): Data about people including their preferences and capacities.
     - shifts_data (dict): Data about shifts including capacities and priorities.
+    - counters (AssignmentCounters): The counters of the schedule, if maintained.
 
     Returns:
     - bool: True if the assignment is valid, False otherwise.
     """
 
-    # Helper function to calculate the number of assigned shift types for a person
-    def retrieve_shift_types(assigned_shifts, shift_type_dict):
-        """
-        Calculate the number of assigned shift types for a person.
-
-        Args:
-        - assigned_shifts (list): List of shifts already assigned to the person.
-        - shift_type_dict (dict): Mapping from shift ID to shift type.
-
-        Returns:
-        - dict: A dictionary with the count of each shift type assigned to the person.
-        """
-
-        assigned_shift_types = {}
-        for assigned_shift in assigned_shifts:
-            assigned_shift_type = shift_type_dict.get(assigned_shift, 0)
-            if assigned_shift_type in assigned_shift_types:
-                assigned_shift_types[assigned_shift_type] += 1
-            else:
-                assigned_shift_types[assigned_shift_type] = 1
-        return assigned_shift_types
-
     # Calculate the number of each shift type already assigned to the person
-    assigned_shift_types = retrieve_shift_types(
-        assigned_shifts_person, shifts_data["shift_type_dict"]
-    )
+    if counters is not None:
+        assigned_shift_types = counters.assigned_shift_types(person_id)
+    else:
+        assigned_shift_types = count_shift_types(
+            assigned_shifts_person, shifts_data["shift_type_dict"]
+        )
 
     # Get the preferred shift types for the person
     person_shift_types = people_data["people_shift_types_dict"].get(person_id, {})
@@ -93,34 +81,22 @@ def is_valid_assignment(
     ):
         return False
 
-    # Check if the shift is restricted and the person is not allowed to work on it
-    if not check_shift_restriction(
-        person_id,
-        people_data["people_shift_types_dict"],
-        new_shift_id,
-        shifts_data["shift_type_dict"],
-        shifts_data["restrict_shift_type_dict"],
-    ):
+    # Check if the shift is restricted or the person is unavailable for it
+    if not check_eligibility(person_id, new_shift_id, people_data, shifts_data):
         return False
 
     # Check if the minimum break requirements are met
     if not check_min_break(assigned_shifts_person, person_id, people_data, shifts_data):
         return False
 
-    # Check if the person is unavailable for the new shift
-    if not check_unavailability(
-        shifts_data["shift_time_dict"],
-        new_shift_id,
-        people_data["unavailability_dict"],
-        person_id,
-    ):
-        return False
-
     # if not check_mandatory(assigned_shifts_person, person_id, people_data, shifts_data):
     #     return False
 
     # Check if the person should not be scheduled with someone they have a conflict with
-    if isEnemy(person_id, schedule[new_shift_id], people_data["preference_dict"]):
+    if counters is not None:
+        if counters.enemies_in_shift(person_id, new_shift_id) > 0:
+            return False
+    elif isEnemy(person_id, schedule[new_shift_id], people_data["enemy_dict"]):
         return False
 
     # If all checks pass, the assignment is valid
@@ -130,36 +106,140 @@ def is_valid_assignment(
 
 
 
+# Share of proposals that target an understaffed shift when such shifts are known
+UNDERSTAFFED_TARGET_PROBABILITY = 0.3
+
+
+def apply_move(schedule, assigned_shifts, move, counters=None):
+    """
+    Apply a move in place.
+
+    Args:
+    - schedule (dict): The schedule to change
+    - assigned_shifts (dict): The shifts assigned to each person, changed alongside
+    - move (tuple): The (person_id, old_shift_id, new_shift_id) entries of the move
+    - counters (AssignmentCounters): The counters of the schedule, updated alongside
+
+    Returns:
+    - tuple: The undo record of the move, to be passed to undo_move
+    """
+    undo = []
+    for person_id, old_shift_id, new_shift_id in move:
+        # Remember the list positions so the undo restores the exact order
+        schedule_position = schedule[old_shift_id].index(person_id)
+        assigned_position = assigned_shifts[person_id].index(old_shift_id)
+        del schedule[old_shift_id][schedule_position]
+        schedule[new_shift_id].append(person_id)
+        del assigned_shifts[person_id][assigned_position]
+        assigned_shifts[person_id].append(new_shift_id)
+        if counters is not None:
+            counters.move_person(person_id, old_shift_id, new_shift_id)
+        undo.append(
+            (person_id, old_shift_id, new_shift_id, schedule_position, assigned_position)
+        )
+    return tuple(undo)
+
+
+def undo_move(schedule, assigned_shifts, undo, counters=None):
+    """
+    Revert a move applied by apply_move in place.
+
+    Args:
+    - schedule (dict): The schedule the move was applied to
+    - assigned_shifts (dict): The shifts assigned to each person
+    - undo (tuple): The undo record returned by apply_move
+    - counters (AssignmentCounters): The counters of the schedule, reverted alongside
+    """
+    for (
+        person_id,
+        old_shift_id,
+        new_shift_id,
+        schedule_position,
+        assigned_position,
+    ) in reversed(undo):
+        schedule[new_shift_id].pop()
+        schedule[old_shift_id].insert(schedule_position, person_id)
+        assigned_shifts[person_id].pop()
+        assigned_shifts[person_id].insert(assigned_position, old_shift_id)
+        if counters is not None:
+            counters.move_person(person_id, new_shift_id, old_shift_id)
+
+
 def swap_or_move_shift(
     schedule,
     assigned_shifts,
     people_data,
     shifts_data,
+    understaffed_shifts=None,
+    counters=None,
+    person_selector=None,
 ):
-    person_a_id = get_random_element(assigned_shifts)  # get a random person
+    """
+    Move a random person to another shift or swap two people between their shifts.
+
+    The move is applied to the schedule and assigned shifts in place. If it violates
+    a hard constraint it is undone again before returning. If counters is given, it
+    is kept in sync with the schedule and used for the hard constraint checks.
+
+    The target shift is drawn from the shifts the moved person is eligible for (see
+    transform_person_shift_data). If understaffed_shifts (a move_selection.IndexedSet)
+    is given, part of the proposals pick the target shift from it instead, if the
+    person is eligible.
+    If person_selector is given (see move_selection.CostGuidedSelector), it draws the
+    person to move instead of a uniform draw.
+
+    Returns:
+    - tuple: The (person_id, old_shift_id, new_shift_id) entries of the move, or None
+      if the neighbor violates a hard constraint
+    - tuple: The undo record of the move (see undo_move), or None
+    """
+    if person_selector is not None:
+        person_a_id = person_selector.sample()  # get a person weighted by cost
+    else:
+        person_a_id = get_random_element(assigned_shifts)  # get a random person
 
     person_a_shift_id = get_random_element(
         assigned_shifts[person_a_id]
     )  # get a random shift of the person
 
-    person_b_id = get_random_element(assigned_shifts)  # get a random person
-
-    person_b_shift_id = get_random_element(
-        assigned_shifts[person_b_id]
-    )  # get a random shift of the person
+    person_b_shift_id = None
+    if understaffed_shifts and random.random() < UNDERSTAFFED_TARGET_PROBABILITY:
+        # get a random understaffed shift
+        person_b_shift_id = understaffed_shifts.sample()
+        if not check_eligibility(person_a_id, person_b_shift_id, people_data, shifts_data):
+            person_b_shift_id = None
+
+    if person_b_shift_id is None:
+        eligible_shifts = people_data["eligible_shifts_dict"].get(person_a_id)
+        if not eligible_shifts:
+            return None, None  # The person cannot work any shift
+        person_b_shift_id = random.choice(
+            eligible_shifts
+        )  # get a random shift the person may work
+
+    person_b_id = (
+        get_random_element(schedule[person_b_shift_id])
+        if schedule[person_b_shift_id]
+        else None
+    )  # get a random person of the shift, if any
 
     if person_a_shift_id == person_b_shift_id or person_a_id == person_b_id:
-        return schedule, assigned_shifts
+        return (), ()
+
+    if person_b_shift_id in assigned_shifts[person_a_id]:
+        return None, None  # The person already works the target shift
 
     shift_a = schedule[person_a_shift_id]
     shift_b = schedule[person_b_shift_id]
-    
-    logging.info(f"Person A: {person_a_id}, Shift A: {person_a_shift_id} and Person B: {person_b_id}, Shift B: {person_b_shift_id}")
-
-    new_schedule = copy.deepcopy(schedule)
-    new_assigned_shifts = copy.deepcopy(assigned_shifts)
-    
 
+    if tracer.enabled:
+        tracer.trace(
+            "Person A: %s, Shift A: %s and Person B: %s, Shift B: %s",
+            person_a_id,
+            person_a_shift_id,
+            person_b_id,
+            person_b_shift_id,
+        )
 
     shift_capacity_dict = shifts_data["shift_capacity_dict"]
 
@@ -171,59 +251,56 @@ def swap_or_move_shift(
         )
     ):
         # Temporarily assign the person to the shift
-        new_schedule[person_a_shift_id].remove(person_a_id)
-        new_schedule[person_b_shift_id].append(person_a_id)
-        new_assigned_shifts[person_a_id].remove(person_a_shift_id)
-        new_assigned_shifts[person_a_id].append(person_b_shift_id)
+        move = ((person_a_id, person_a_shift_id, person_b_shift_id),)
+        undo = apply_move(schedule, assigned_shifts, move, counters)
 
         if is_valid_assignment(
-            new_schedule.copy(),
+            schedule,
             person_b_shift_id,
             person_a_id,
-            new_assigned_shifts.copy()[person_a_id],
+            assigned_shifts[person_a_id],
             people_data,
             shifts_data,
+            counters,
         ):
-            return (
-                new_schedule,
-                new_assigned_shifts,
-            )  # The neighbor solution satisfies both hard constraints
-        else:
-            return None, None
+            return move, undo  # The neighbor solution satisfies both hard constraints
 
-    else:  # Swap people between the shifts if possible
+    elif person_b_id is None:  # Nobody to swap with in an empty shift
+        return None, None
 
-        new_schedule[person_a_shift_id].remove(person_a_id)
-        new_schedule[person_b_shift_id].append(person_a_id)
-        new_assigned_shifts[person_a_id].remove(person_a_shift_id)
-        new_assigned_shifts[person_a_id].append(person_b_shift_id)
+    elif person_a_shift_id in assigned_shifts[person_b_id] or not check_eligibility(
+        person_b_id, person_a_shift_id, people_data, shifts_data
+    ):
+        return None, None  # The other person already works or may not work the shift
 
-        new_schedule[person_b_shift_id].remove(person_b_id)
-        new_schedule[person_a_shift_id].append(person_b_id)
-        new_assigned_shifts[person_b_id].remove(person_b_shift_id)
-        new_assigned_shifts[person_b_id].append(person_a_shift_id)
+    else:  # Swap people between the shifts if possible
+        move = (
+            (person_a_id, person_a_shift_id, person_b_shift_id),
+            (person_b_id, person_b_shift_id, person_a_shift_id),
+        )
+        undo = apply_move(schedule, assigned_shifts, move, counters)
 
         if is_valid_assignment(
-            new_schedule.copy(),
+            schedule,
             person_b_shift_id,
             person_a_id,
-            new_assigned_shifts.copy()[person_a_id],
+            assigned_shifts[person_a_id],
             people_data,
             shifts_data,
+            counters,
         ) and is_valid_assignment(
-            new_schedule.copy(),
+            schedule,
             person_a_shift_id,
             person_b_id,
-            new_assigned_shifts.copy()[person_b_id],
+            assigned_shifts[person_b_id],
             people_data,
             shifts_data,
+            counters,
         ):
-            return (
-                new_schedule,
-                new_assigned_shifts,
-            )  # The neighbor solution satisfies both hard constraints
-        else:
-            return None, None
+            return move, undo  # The neighbor solution satisfies both hard constraints
+
+    undo_move(schedule, assigned_shifts, undo, counters)
+    return None, None
 
 
 def get_neighbor(
@@ -232,33 +309,56 @@ def get_neighbor(
     shifts_data,
     people_data,
     max_attempts=10000,
+    understaffed_shifts=None,
+    proposal_stats=None,
+    counters=None,
+    person_selector=None,
 ):
+    """
+    Apply a random valid move to the schedule and assigned shifts in place.
+
+    If proposal_stats is given, its "proposals" and "rejected" counts are increased
+    by the number of drawn and rejected proposals. If counters is given, it is kept
+    in sync with the schedule and person_selector draws the moved person (see
+    swap_or_move_shift).
+
+    Returns:
+    - tuple: The (person_id, old_shift_id, new_shift_id) entries of the move, or None
+      if no valid neighbor is found after max_attempts
+    - tuple: The undo record to revert the move with undo_move, or None
+    """
     attempts = 0
 
     while attempts < max_attempts:
-        new_schedule, new_assigned_shifts = swap_or_move_shift(
-            schedule.copy(),
-            assigned_shifts.copy(),
+        move, undo = swap_or_move_shift(
+            schedule,
+            assigned_shifts,
             people_data,
             shifts_data,
+            understaffed_shifts,
+            counters,
+            person_selector,
         )
-        if new_schedule and new_assigned_shifts:
-            return new_schedule, new_assigned_shifts
+        if proposal_stats is not None:
+            proposal_stats["proposals"] += 1
+        if move is not None:
+            return move, undo
         else:
             attempts += 1
+            if proposal_stats is not None:
+                proposal_stats["rejected"] += 1
 
-    # Return the original solution if no valid neighbor is found after max_attempts
+    # Leave the original solution untouched if no valid neighbor is found after max_attempts
     print("No valid neighbor found after", max_attempts, "attempts")
     return None, None
 
 
-def isEnemy(person, shift, preference_dict):
-    if person not in preference_dict:
+def isEnemy(person, shift, enemy_dict):
+    # The enemies of every person are collected once by transform_people_data
+    enemies = enemy_dict.get(person)
+    if not enemies:
         return False
 
-    # Create a set of enemies for the person
-    enemies = {p[0] for p in preference_dict[person] if p[1] == 1}
-
     # Check if any person in the shift is an enemy
     return any(other_person in enemies for other_person in shift)
 
@@ -310,44 +410,39 @@ def exceed_person_shift_type_capacity(
     return False
 
 
-def check_shift_restriction(
-    person, people_shift_types_dict, shift_id, shift_type_dict, restrict_shift_type_dict
-):
-    shift_type = shift_type_dict.get(shift_id)
-    if restrict_shift_type_dict.get(shift_id):
-        return shift_type in people_shift_types_dict.get(person, [])
-    return True
-
+def check_eligibility(person, shift_id, people_data, shifts_data):
+    """
+    Check whether a person may work a shift at all.
 
-def check_unavailability(shift_time_dict, shift_id, unavailability_dict, person):
-    shift_start, shift_end = shift_time_dict.get(shift_id)
-    unavailability_periods = unavailability_dict.get(person, [])
+    Args:
+    - person (int): The person to check
+    - shift_id (int): The shift to check
+    - people_data (dict): The people data
+    - shifts_data (dict): The shifts data
 
-    for unavailability_start, unavailability_end in unavailability_periods:
-        if not (shift_end <= unavailability_start or shift_start >= unavailability_end):
-            return False
-    return True
+    Returns:
+    - bool: False if the shift is restricted to a shift type the person lacks or
+      overlaps an unavailability of the person
+    """
+    # Shift type restrictions and unavailability are precomputed by transform_person_shift_data
+    shift_index = shifts_data["shift_index_dict"][shift_id]
+    mask = people_data["eligible_shift_mask_dict"].get(person, 0)
+    return (mask >> shift_index) & 1 == 1
 
 
 def check_mandatory(assigned_shifts_person, person_id, people_data, shifts_data):
     mandatory_periods = people_data["mandatory_dict"].get(person_id, [])
+    if not mandatory_periods:
+        return True
 
-    # Set to keep track of mandatory periods that have been satisfied
-    satisfied_periods = set()
-
+    # Combine the precomputed masks of the mandatory periods each shift lies within
+    mandatory_masks = people_data["mandatory_mask_dict"].get(person_id, {})
+    satisfied_periods = 0
     for shift_id in assigned_shifts_person:
-        shift_start, shift_end = shifts_data["shift_time_dict"].get(
-            shift_id, (None, None)
-        )
-        if shift_start is None or shift_end is None:
-            continue  # Skip if shift times are not found
-
-        for mandatory_start, mandatory_end in mandatory_periods:
-            if shift_start >= mandatory_start and shift_end <= mandatory_end:
-                satisfied_periods.add((mandatory_start, mandatory_end))
+        satisfied_periods |= mandatory_masks.get(shift_id, 0)
 
     # If all mandatory periods are satisfied, return True
-    if len(satisfied_periods) >= len(mandatory_periods):
+    if bin(satisfied_periods).count("1") >= len(mandatory_periods):
         return True
 
     return False
@@ -357,20 +452,13 @@ def check_min_break(person_shifts, person, people_data, shifts_data):
     if not person_shifts:
         return True  # If no shifts are assigned, there's no break violation
 
-    # Retrieve the start and end times of the shifts
-    shift_time_dict = shifts_data["shift_time_dict"]
-    person_shifts = sorted(
-        [
-            (shift_time_dict[shift][0], shift_time_dict[shift][1])
-            for shift in person_shifts
-        ]
-    )
-
-    min_break = people_data["minimum_break_dict"].get(person, 0)
-
-    # Check the break between consecutive shifts
-    for i in range(1, len(person_shifts)):
-        if person_shifts[i][0] - person_shifts[i - 1][1] < min_break:
+    # Shifts closer than the minimum break share a bit of their precomputed break masks
+    break_masks = people_data["break_mask_dict"][person]
+    occupied = 0
+    for shift in person_shifts:
+        break_mask = break_masks[shift]
+        if occupied & break_mask:
             return False
+        occupied |= break_mask
 
     return True
@@ -0,0 +1,389 @@
+import math
+from cost_calculation import (
+    individual_cost_value,
+    shift_average,
+    shift_priority_term,
+    BALANCE_FACTOR,
+    EXPERIENCE_FACTOR,
+    GENDER_DISTRIBUTION_FACTOR,
+    USE_EXPERIENCE_COST,
+)
+from error_handling import raise_not_found_error
+from move_selection import IndexedSet
+
+# Recompute the running aggregates from the cached terms every n accepted moves
+# to stop floating point drift from accumulating
+AGGREGATE_RESYNC_INTERVAL = 10000
+
+
+def build_related_people(preference_dict):
+    """
+    Build a reverse lookup from a person to everyone who lists them as friend or enemy.
+
+    Args:
+    - preference_dict (dict): Mapping from person ID to a list of (person ID, flag) tuples
+
+    Returns:
+    - dict: Mapping from person ID to the set of people whose preference cost depends on them
+    """
+    related_people = {}
+    for person_id, preferences in preference_dict.items():
+        for colleague_id, flag in preferences:
+            if flag != 0:
+                related_people.setdefault(colleague_id, set()).add(person_id)
+    return related_people
+
+
+class RunningDeviation:
+    """
+    Running count, sum and sum of squares of a set of values.
+
+    Adding or removing a value is O(1) and so is the sample standard deviation.
+    """
+
+    __slots__ = ("count", "total", "square_total")
+
+    def __init__(self, values=()):
+        values = list(values)
+        self.count = len(values)
+        self.total = math.fsum(values)
+        self.square_total = math.fsum(value * value for value in values)
+
+    def add(self, value):
+        self.count += 1
+        self.total += value
+        self.square_total += value * value
+
+    def remove(self, value):
+        self.count -= 1
+        self.total -= value
+        self.square_total -= value * value
+
+    def replace(self, old_value, new_value):
+        """Replace a value, where None stands for a value that is not part of the set."""
+        if old_value is not None:
+            self.remove(old_value)
+        if new_value is not None:
+            self.add(new_value)
+
+    def copy(self):
+        running_deviation = RunningDeviation()
+        running_deviation.count = self.count
+        running_deviation.total = self.total
+        running_deviation.square_total = self.square_total
+        return running_deviation
+
+    def stdev(self):
+        """Return the sample standard deviation, 0 for less than two values."""
+        if self.count < 2:
+            return 0
+        variance = (self.square_total - self.total * self.total / self.count) / (
+            self.count - 1
+        )
+        return math.sqrt(max(variance, 0))
+
+
+class IncrementalCostEvaluator:
+    """
+    Keeps the cost terms of a schedule cached and recomputes only the terms a move touches.
+
+    A move is a tuple of (person_id, old_shift_id, new_shift_id) entries as returned by
+    hard_constraints.swap_or_move_shift. The cached terms are:
+    - the individual cost of every person (the breakdown is left to
+      cost_calculation.explain_cost for reports)
+    - the value sum and average of every shift for the gender (and, if enabled,
+      experience) distribution costs
+    - the priority penalty of every shift and the set of understaffed shifts
+      (below their minimum capacity, a move_selection.IndexedSet), which the move
+      generator can target
+
+    The individual cost of a person depends on their own shifts and, through the
+    preference cost, on the shifts of their friends and enemies. A move therefore
+    dirties the moved people and everyone who lists one of them as friend or enemy.
+
+    The deviation based costs (individual balance, gender and experience distribution)
+    are kept as running sums and sums of squares, so they are updated in O(1).
+
+    If the AssignmentCounters of the schedule are given, the shift type cost reads
+    the shift type counts from them instead of recounting them.
+    """
+
+    def __init__(
+        self, schedule, assigned_shifts, people_data, shifts_data, counters=None
+    ):
+        self.people_data = people_data
+        self.shifts_data = shifts_data
+        self.counters = counters
+        self.related_people = build_related_people(people_data["preference_dict"])
+
+        # (value dict, factor) of every active shift distribution cost
+        self.distribution_terms = {}
+        if people_data["gender_dict"]:
+            self.distribution_terms["gender"] = (
+                people_data["gender_dict"],
+                GENDER_DISTRIBUTION_FACTOR,
+            )
+        if USE_EXPERIENCE_COST and people_data.get("experience_dict"):
+            self.distribution_terms["experience"] = (
+                people_data["experience_dict"],
+                EXPERIENCE_FACTOR,
+            )
+
+        self._pending = None
+        self.reset(schedule, assigned_shifts)
+
+    def reset(self, schedule, assigned_shifts):
+        """
+        Recalculate every cached term from scratch.
+
+        Args:
+        - schedule (dict): The schedule to evaluate
+        - assigned_shifts (dict): The shifts assigned to each person
+
+        Returns:
+        - float: The total cost of the schedule
+        """
+        self.individual_costs = {}
+        for person_id in self.people_data["name_dict"]:
+            if person_id not in assigned_shifts:
+                raise_not_found_error(f"Person {person_id} not in assigned shifts")
+
+            self.individual_costs[person_id] = individual_cost_value(
+                schedule,
+                person_id,
+                assigned_shifts[person_id],
+                self.people_data,
+                self.shifts_data,
+                self._assigned_shift_types(person_id),
+            )
+
+        self.shift_sizes = {shift_id: len(shift) for shift_id, shift in schedule.items()}
+        self.understaffed_shifts = IndexedSet(
+            shift_id
+            for shift_id, shift_size in self.shift_sizes.items()
+            if self._is_understaffed(shift_id, shift_size)
+        )
+        self.shift_priority_costs = {
+            shift_id: shift_priority_term(shift_id, shift, self.shifts_data)
+            for shift_id, shift in schedule.items()
+        }
+
+        self.shift_value_sums = {}
+        self.shift_averages = {}
+        for name, (value_dict, _) in self.distribution_terms.items():
+            self.shift_value_sums[name] = {
+                shift_id: sum(value_dict.get(person_id) or 0 for person_id in shift)
+                for shift_id, shift in schedule.items()
+            }
+            self.shift_averages[name] = {
+                shift_id: shift_average(shift, value_dict)
+                for shift_id, shift in schedule.items()
+            }
+
+        self._pending = None
+        self.last_updated_people = ()
+        self._refresh_aggregates()
+        return self.current_cost
+
+    def _assigned_shift_types(self, person_id):
+        if self.counters is None:
+            return None  # Counted by shift_type_cost
+        return self.counters.assigned_shift_types(person_id)
+
+    def _is_understaffed(self, shift_id, shift_size):
+        return shift_size < self.shifts_data["shift_capacity_dict"][shift_id][0]
+
+    def _refresh_aggregates(self):
+        # Rebuild the running sums from the cached terms
+        self.individual_cost_total = sum(self.individual_costs.values())
+        self.individual_deviation = RunningDeviation(self.individual_costs.values())
+        self.priority_cost_total = sum(self.shift_priority_costs.values())
+        self.shift_deviations = {
+            name: RunningDeviation(
+                average for average in averages.values() if average is not None
+            )
+            for name, averages in self.shift_averages.items()
+        }
+        self.accepted_moves = 0
+        self.current_cost = self._combine(
+            self.individual_cost_total,
+            self.individual_deviation,
+            self.priority_cost_total,
+            self.shift_deviations,
+        )
+
+    def _combine(
+        self, individual_cost_total, individual_deviation, priority_cost, shift_deviations
+    ):
+        # Same composition as cost_calculation.cost_value
+        individual_balance_cost = individual_deviation.stdev() * BALANCE_FACTOR
+
+        distribution_cost = 0
+        for name, (_, factor) in self.distribution_terms.items():
+            distribution_cost += shift_deviations[name].stdev() * factor
+
+        return (
+            +individual_cost_total
+            + priority_cost
+            + individual_balance_cost
+            + distribution_cost
+        )
+
+    def evaluate_move(self, schedule, assigned_shifts, move):
+        """
+        Calculate the cost difference caused by a move without committing it.
+
+        The schedule and assigned shifts must already reflect the move. The result
+        is kept as pending until accept() or reject() is called.
+
+        Args:
+        - schedule (dict): The schedule after the move
+        - assigned_shifts (dict): The shifts assigned to each person after the move
+        - move (tuple): The (person_id, old_shift_id, new_shift_id) entries of the move
+
+        Returns:
+        - float: The cost of the moved schedule minus the current cost
+        """
+        moved_people = set()
+        touched_shifts = set()
+        for person_id, old_shift_id, new_shift_id in move:
+            moved_people.add(person_id)
+            touched_shifts.add(old_shift_id)
+            touched_shifts.add(new_shift_id)
+
+        dirty_people = set(moved_people)
+        for person_id in moved_people:
+            dirty_people |= self.related_people.get(person_id, set())
+
+        # Recompute the individual costs of the dirty people only
+        new_individual_costs = {}
+        individual_cost_total = self.individual_cost_total
+        individual_deviation = self.individual_deviation.copy()
+        for person_id in dirty_people:
+            if person_id not in self.individual_costs:
+                continue  # Preferences may reference people that are not scheduled
+            new_individual_costs[person_id] = individual_cost_value(
+                schedule,
+                person_id,
+                assigned_shifts[person_id],
+                self.people_data,
+                self.shifts_data,
+                self._assigned_shift_types(person_id),
+            )
+            individual_cost_total += (
+                new_individual_costs[person_id] - self.individual_costs[person_id]
+            )
+            individual_deviation.replace(
+                self.individual_costs[person_id], new_individual_costs[person_id]
+            )
+
+        # Recompute the shift terms of the touched shifts only
+        new_shift_sizes = {}
+        new_shift_priority_costs = {}
+        priority_cost_total = self.priority_cost_total
+        for shift_id in touched_shifts:
+            new_shift_sizes[shift_id] = len(schedule[shift_id])
+            new_shift_priority_costs[shift_id] = shift_priority_term(
+                shift_id, schedule[shift_id], self.shifts_data
+            )
+            priority_cost_total += (
+                new_shift_priority_costs[shift_id] - self.shift_priority_costs[shift_id]
+            )
+
+        # Shift the moved people's values between the touched shifts
+        new_shift_value_sums = {}
+        new_shift_averages = {}
+        shift_deviations = {}
+        for name, (value_dict, _) in self.distribution_terms.items():
+            value_sums = {
+                shift_id: self.shift_value_sums[name][shift_id]
+                for shift_id in touched_shifts
+            }
+            for person_id, old_shift_id, new_shift_id in move:
+                value = value_dict.get(person_id) or 0
+                value_sums[old_shift_id] -= value
+                value_sums[new_shift_id] += value
+
+            averages = {}
+            shift_deviations[name] = self.shift_deviations[name].copy()
+            for shift_id, value_sum in value_sums.items():
+                averages[shift_id] = (
+                    value_sum / new_shift_sizes[shift_id]
+                    if new_shift_sizes[shift_id] > 0
+                    else None
+                )
+                shift_deviations[name].replace(
+                    self.shift_averages[name][shift_id], averages[shift_id]
+                )
+            new_shift_value_sums[name] = value_sums
+            new_shift_averages[name] = averages
+
+        new_cost = self._combine(
+            individual_cost_total,
+            individual_deviation,
+            priority_cost_total,
+            shift_deviations,
+        )
+
+        self._pending = (
+            new_individual_costs,
+            new_shift_sizes,
+            new_shift_priority_costs,
+            new_shift_value_sums,
+            new_shift_averages,
+            individual_cost_total,
+            individual_deviation,
+            priority_cost_total,
+            shift_deviations,
+            new_cost,
+        )
+        return new_cost - self.current_cost
+
+    def accept(self):
+        """
+        Commit the pending move evaluated by evaluate_move().
+
+        The people whose individual cost was recalculated are kept in
+        last_updated_people.
+
+        Returns:
+        - float: The new total cost
+        """
+        if self._pending is None:
+            return self.current_cost
+
+        (
+            new_individual_costs,
+            new_shift_sizes,
+            new_shift_priority_costs,
+            new_shift_value_sums,
+            new_shift_averages,
+            self.individual_cost_total,
+            self.individual_deviation,
+            self.priority_cost_total,
+            self.shift_deviations,
+            self.current_cost,
+        ) = self._pending
+
+        self.individual_costs.update(new_individual_costs)
+        self.last_updated_people = tuple(new_individual_costs)
+        self.shift_sizes.update(new_shift_sizes)
+        for shift_id, shift_size in new_shift_sizes.items():
+            if self._is_understaffed(shift_id, shift_size):
+                self.understaffed_shifts.add(shift_id)
+            else:
+                self.understaffed_shifts.discard(shift_id)
+        self.shift_priority_costs.update(new_shift_priority_costs)
+        for name in self.distribution_terms:
+            self.shift_value_sums[name].update(new_shift_value_sums[name])
+            self.shift_averages[name].update(new_shift_averages[name])
+        self._pending = None
+
+        self.accepted_moves += 1
+        if self.accepted_moves >= AGGREGATE_RESYNC_INTERVAL:
+            self._refresh_aggregates()
+        return self.current_cost
+
+    def reject(self):
+        """Discard the pending move evaluated by evaluate_move()."""
+        self._pending = None
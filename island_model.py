@@ -0,0 +1,193 @@
+import math
+from multiprocessing import shared_memory
+import numpy as np
+
+# Annealing steps between two migrations of an island
+DEFAULT_MIGRATION_INTERVAL = 500
+# Reads of a slot that is being written before a migration is skipped
+MAX_READ_ATTEMPTS = 10
+
+# Every slot starts with the cost (float64) and a version counter (int64)
+SLOT_HEADER_SIZE = 16
+
+
+class ScheduleCodec:
+    """
+    Packs the assignments of a schedule into a bit matrix of people x shifts.
+
+    Rows follow person_index_dict and columns shift_index_dict, so a schedule takes
+    one bit per (person, shift) pair and is copied as a flat byte array instead of
+    pickling the schedule dicts.
+    """
+
+    def __init__(self, people_data, shifts_data):
+        self.person_index_dict = people_data["person_index_dict"]
+        self.shift_index_dict = shifts_data["shift_index_dict"]
+        self.person_ids = list(self.person_index_dict)
+        self.shift_ids = list(self.shift_index_dict)
+        self.encoded_size = math.ceil(len(self.person_ids) * len(self.shift_ids) / 8)
+
+    def encode(self, assigned_shifts, out=None):
+        """
+        Pack the assigned shifts into bytes.
+
+        Args:
+        - assigned_shifts (dict): The shifts assigned to each person
+        - out (np.ndarray): A uint8 array of encoded_size to write to, if given
+
+        Returns:
+        - np.ndarray: The packed uint8 array
+        """
+        matrix = np.zeros((len(self.person_ids), len(self.shift_ids)), dtype=bool)
+        for person_id, shifts in assigned_shifts.items():
+            row = self.person_index_dict[person_id]
+            for shift_id in shifts:
+                matrix[row, self.shift_index_dict[shift_id]] = True
+        packed = np.packbits(matrix, axis=None)
+        if out is None:
+            return packed
+        out[:] = packed
+        return out
+
+    def decode(self, encoded):
+        """
+        Unpack bytes into a schedule and the assigned shifts.
+
+        Returns:
+        - dict: The schedule
+        - dict: The shifts assigned to each person
+        """
+        matrix = np.unpackbits(
+            encoded, count=len(self.person_ids) * len(self.shift_ids)
+        ).reshape(len(self.person_ids), len(self.shift_ids))
+        schedule = {shift_id: [] for shift_id in self.shift_ids}
+        assigned_shifts = {person_id: [] for person_id in self.person_ids}
+        for row, column in zip(*np.nonzero(matrix)):
+            person_id = self.person_ids[row]
+            shift_id = self.shift_ids[column]
+            schedule[shift_id].append(person_id)
+            assigned_shifts[person_id].append(shift_id)
+        return schedule, assigned_shifts
+
+
+def create_island_memory(num_islands, people_data, shifts_data):
+    """
+    Create the shared memory block holding the best schedule of every island.
+
+    The caller owns the block and has to close() and unlink() it after the run.
+
+    Returns:
+    - SharedMemory: The block, with every slot set to an infinite cost
+    """
+    slot_size = island_slot_size(ScheduleCodec(people_data, shifts_data))
+    memory = shared_memory.SharedMemory(create=True, size=num_islands * slot_size)
+    for island in range(num_islands):
+        header = np.ndarray(
+            2, dtype=np.float64, buffer=memory.buf, offset=island * slot_size
+        )
+        header[0] = math.inf
+        header.view(np.int64)[1] = 0
+    return memory
+
+
+def island_slot_size(codec):
+    # Rounded up to 8 bytes so the header of every slot stays aligned
+    return SLOT_HEADER_SIZE + math.ceil(codec.encoded_size / 8) * 8
+
+
+class IslandMigration:
+    """
+    Exchanges the best schedules of the islands of a ring through shared memory.
+
+    Every island publishes its best schedule to its own slot and adopts the best
+    schedule of the next island on the ring if that one is cheaper than its own
+    best. A slot has a single writer, which makes the version counter odd while it
+    writes, so readers retry torn reads instead of locking (a seqlock).
+
+    simulated_annealing calls migrate() every interval steps.
+    """
+
+    def __init__(
+        self,
+        memory_name,
+        island,
+        num_islands,
+        people_data,
+        shifts_data,
+        interval=DEFAULT_MIGRATION_INTERVAL,
+    ):
+        self.codec = ScheduleCodec(people_data, shifts_data)
+        self.island = island
+        self.neighbor = (island + 1) % num_islands
+        self.interval = interval
+        self.memory = shared_memory.SharedMemory(name=memory_name)
+        slot_size = island_slot_size(self.codec)
+        self.slots = [
+            self._slot_views(index * slot_size) for index in range(num_islands)
+        ]
+        self.published_cost = math.inf
+        self.adopted = 0
+
+    def _slot_views(self, offset):
+        cost = np.ndarray(1, dtype=np.float64, buffer=self.memory.buf, offset=offset)
+        version = np.ndarray(
+            1, dtype=np.int64, buffer=self.memory.buf, offset=offset + 8
+        )
+        encoded = np.ndarray(
+            self.codec.encoded_size,
+            dtype=np.uint8,
+            buffer=self.memory.buf,
+            offset=offset + SLOT_HEADER_SIZE,
+        )
+        return cost, version, encoded
+
+    def publish(self, cost, assigned_shifts):
+        slot_cost, version, encoded = self.slots[self.island]
+        version[0] += 1
+        self.codec.encode(assigned_shifts, out=encoded)
+        slot_cost[0] = cost
+        version[0] += 1
+        self.published_cost = cost
+
+    def read(self, island):
+        """
+        Read the published schedule of an island.
+
+        Returns:
+        - float: The published cost, infinite if there is none or the slot kept changing
+        - np.ndarray: A copy of the encoded schedule
+        """
+        slot_cost, version, encoded = self.slots[island]
+        for _ in range(MAX_READ_ATTEMPTS):
+            start_version = int(version[0])
+            if start_version % 2 == 1:
+                continue  # Being written
+            cost = float(slot_cost[0])
+            copied = encoded.copy()
+            if int(version[0]) == start_version:
+                return cost, copied
+        return math.inf, None
+
+    def migrate(self, state):
+        """
+        Publish the best schedule of an AnnealingState and adopt the neighbor's if cheaper.
+
+        Returns:
+        - bool: Whether the state adopted the neighbor's schedule
+        """
+        if state.best_cost < self.published_cost:
+            self.publish(state.best_cost, state.best_assigned_shifts)
+
+        neighbor_cost, encoded = self.read(self.neighbor)
+        if neighbor_cost >= state.best_cost:
+            return False
+
+        state.best_schedule, state.best_assigned_shifts = self.codec.decode(encoded)
+        state.best_cost = neighbor_cost
+        state.restore_best()
+        self.adopted += 1
+        return True
+
+    def close(self):
+        self.slots = []
+        self.memory.close()
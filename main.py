@@ -1,17 +1,25 @@
 from excel_processing import process_people_data, process_shifts_data, create_file, load_excel_and_create_solution
-from data_transformation import transform_people_data, transform_shifts_data
+from data_transformation import (
+    transform_people_data,
+    transform_shifts_data,
+    transform_person_shift_data,
+)
 from simulated_annealing import run_parallel_simulated_annealing, simulated_annealing
 from cost_calculation import (
-    cost_function,
+    explain_cost,
 )
-from utilities import replace_numbers_with_names
+from vectorized_cost import batch_cost_function
+from utilities import replace_numbers_with_names, available_cpu_count
 from sql_processing import process_supporter_data, process_supporter_shifts_data, write_to_db
+import argparse
 import sqlite3
 import os
+import math
 import mysql.connector
 from dotenv import load_dotenv
 
 from prevent_sleep import PreventSleep
+from logger import logging
 
 
 PROJECT_ID = 15
@@ -28,8 +36,14 @@ cooling_rate = 0.999
 use_db = True
 use_excel = False
 activate_parallelization = False
-num_of_parallel_threads = 14
+num_of_parallel_threads = available_cpu_count()  # CPU affinity or cgroup limit
 max_iterations_without_improvement = 1000
+time_budget = None  # Seconds after which the best schedule found so far is returned
+target_cost = None  # Stop as soon as a schedule costs at most this much
+cooling_schedule = "geometric"  # "geometric", "acceptance_rate" or "plateau"
+reheats = 0  # Restarts from the best schedule before the run ends
+parallel_mode = "independent"  # "independent", "tempering", "islands" or "racing"
+checkpoint_path = "annealing_checkpoint.pkl"  # None disables the checkpoints
 excel_file_path = "SCC_SCHICHTPLAN_FINAL.xlsx"
 input_solution_path = "SCC_SCHICHTPLAN_2024_B.xlsx"
 
@@ -60,7 +74,7 @@ def create_db_connection():
 
     return connection
 
-def run_simulation():
+def run_simulation(resume=False):
     
     db_connection = None
     # Example usage:
@@ -85,10 +99,22 @@ def run_simulation():
 
     shifts_transformed_data = transform_shifts_data(shifts_data)
     people_transformed_data = transform_people_data(people_data)
+    people_transformed_data = transform_person_shift_data(
+        people_transformed_data, shifts_transformed_data
+    )
 
     print("Starting simulated annealing")
 
     if activate_parallelization:
+        # The tempering replicas run at fixed temperatures, without cooling schedule
+        if parallel_mode == "tempering":
+            annealing_options = {}
+        else:
+            annealing_options = {"cooling_schedule": cooling_schedule, "reheats": reheats}
+        # Only the independent runs write checkpoints, the other modes reject resume
+        if parallel_mode == "independent":
+            annealing_options["checkpoint_path"] = checkpoint_path
+        annealing_options["resume"] = resume
         best_schedule, best_assigned_shifts, best_cost, init_cost = run_parallel_simulated_annealing(
             num_of_parallel_threads,
             people_transformed_data,
@@ -96,6 +122,10 @@ def run_simulation():
             initial_temperature,
             cooling_rate,
             max_iterations_without_improvement,
+            time_budget=time_budget,
+            target_cost=target_cost,
+            mode=parallel_mode,
+            **annealing_options,
         )
     else:
         best_schedule, best_assigned_shifts, best_cost, init_cost = simulated_annealing(
@@ -104,6 +134,12 @@ def run_simulation():
             initial_temperature,
             cooling_rate,
             max_iterations_without_improvement,
+            time_budget=time_budget,
+            target_cost=target_cost,
+            cooling_schedule=cooling_schedule,
+            reheats=reheats,
+            checkpoint_path=checkpoint_path,
+            resume=resume,
         )
 
     if best_schedule is None:
@@ -111,13 +147,22 @@ def run_simulation():
         exit()
 
     # Check the cost of each person
-    total_cost, total_cost_breakdown, cost_details = cost_function(
+    total_cost, total_cost_breakdown, cost_details = explain_cost(
         best_schedule,
         best_assigned_shifts,
         people_transformed_data,
         shifts_transformed_data,
-        True,
     )
+
+    # Audit the final cost with the vectorized cost engine
+    audit_cost = batch_cost_function(
+        [best_assigned_shifts], people_transformed_data, shifts_transformed_data
+    )[0]
+    if not math.isclose(audit_cost, total_cost, rel_tol=1e-9):
+        logging.warning(
+            f"Cost audit mismatch: explain_cost={total_cost}, vectorized={audit_cost}"
+        )
+
     name_list = people_transformed_data["name_dict"]
     best_solution_with_names = replace_numbers_with_names(best_schedule, name_list)
     print(f"Best solution with names: {best_solution_with_names}")
@@ -157,13 +202,31 @@ def run_simulation():
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Create the shift schedule.")
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="continue the interrupted run from its checkpoint (see checkpoint_path)",
+    )
+    args = parser.parse_args()
+    if args.resume and checkpoint_path is None:
+        parser.error("--resume needs a checkpoint_path")
+    if args.resume and activate_parallelization and parallel_mode != "independent":
+        parser.error(f"--resume is not supported in the {parallel_mode} parallel mode")
+    if activate_parallelization and parallel_mode == "racing" and (
+        cooling_schedule != "geometric" or reheats
+    ):
+        parser.error(
+            "The racing parallel mode only supports the geometric cooling schedule "
+            "without reheats"
+        )
 
     # for i in range(7):
     prevent_sleep = PreventSleep()
     try:
         print("Preventing the system from sleeping...")
         prevent_sleep.start()
-        run_simulation()
+        run_simulation(resume=args.resume)
     except KeyboardInterrupt:
         print("Exiting and allowing the system to sleep.")
     finally:
@@ -0,0 +1,217 @@
+import random
+from cost_calculation import (
+    preference_cost,
+    off_day_cost,
+    time_frame_cost,
+    shift_type_cost,
+    check_mandatory,
+)
+
+# Share of the proposals that pick the moved person uniformly instead of by cost
+DEFAULT_EXPLORATION_SHARE = 0.2
+
+
+def mandatory_cost(schedule, person_id, assigned_shifts_person, people_data, shifts_data):
+    # check_mandatory with the argument order of the other individual cost terms
+    return check_mandatory(assigned_shifts_person, person_id, people_data, shifts_data)
+
+
+# Individual cost terms a selection can be guided by, keyed like the cost breakdown
+GUIDE_TERMS = {
+    "preference_cost": preference_cost,
+    "off_day_cost": off_day_cost,
+    "time_frame_costs": time_frame_cost,
+    "shift_type_cost": shift_type_cost,
+    "mandatory_costs": mandatory_cost,
+}
+
+
+class IndexedSet:
+    """
+    Set with O(1) add, discard and uniform sampling.
+
+    The items are kept in a list with a dict from item to list position. A
+    discarded item is swapped with the last one, so the order only depends on the
+    sequence of adds and discards. Iteration follows that order, which
+    list(indexed_set) captures and IndexedSet(items) restores.
+    """
+
+    def __init__(self, items=()):
+        self.items = []
+        self.position_dict = {}
+        for item in items:
+            self.add(item)
+
+    def add(self, item):
+        if item not in self.position_dict:
+            self.position_dict[item] = len(self.items)
+            self.items.append(item)
+
+    def discard(self, item):
+        position = self.position_dict.pop(item, None)
+        if position is None:
+            return
+        last_item = self.items.pop()
+        if last_item != item:
+            self.items[position] = last_item
+            self.position_dict[last_item] = position
+
+    def sample(self):
+        """Draw an item uniformly."""
+        return random.choice(self.items)
+
+    def __contains__(self, item):
+        return item in self.position_dict
+
+    def __len__(self):
+        return len(self.items)
+
+    def __iter__(self):
+        return iter(self.items)
+
+
+class FenwickTree:
+    """
+    Binary indexed tree over non-negative weights.
+
+    Changing a weight and drawing an index in proportion to the weights are both
+    O(log n).
+    """
+
+    def __init__(self, weights):
+        self.rebuild(weights)
+
+    def rebuild(self, weights):
+        """Set all weights at once in O(n), which also clears accumulated rounding errors."""
+        self.weights = [max(weight, 0) for weight in weights]
+        self.tree = [0.0] + self.weights
+        for index in range(1, len(self.tree)):
+            parent = index + (index & -index)
+            if parent < len(self.tree):
+                self.tree[parent] += self.tree[index]
+
+    def update(self, position, weight):
+        weight = max(weight, 0)
+        delta = weight - self.weights[position]
+        self.weights[position] = weight
+        index = position + 1
+        while index < len(self.tree):
+            self.tree[index] += delta
+            index += index & -index
+
+    def total(self):
+        total = 0.0
+        index = len(self.weights)
+        while index > 0:
+            total += self.tree[index]
+            index -= index & -index
+        return total
+
+    def find(self, target):
+        """Return the position whose cumulative weight range contains target."""
+        position = 0
+        step = 1 << (len(self.weights).bit_length())
+        while step > 0:
+            next_position = position + step
+            if next_position < len(self.tree) and self.tree[next_position] <= target:
+                position = next_position
+                target -= self.tree[next_position]
+            step >>= 1
+        return min(position, len(self.weights) - 1)
+
+
+class CostGuidedSelector:
+    """
+    Draws the person to move in proportion to their current cost.
+
+    The weight of a person is their cached individual cost, or the sum of the
+    GUIDE_TERMS named in guide_terms. With probability exploration_share (and
+    whenever all weights are zero) the person is drawn uniformly instead, so people
+    without cost still get moved to make room.
+    """
+
+    def __init__(
+        self, people, weight_function, exploration_share=DEFAULT_EXPLORATION_SHARE
+    ):
+        self.people = list(people)
+        self.position_dict = {
+            person_id: position for position, person_id in enumerate(self.people)
+        }
+        self.weight_function = weight_function
+        self.exploration_share = exploration_share
+        self.tree = FenwickTree(
+            [weight_function(person_id) for person_id in self.people]
+        )
+
+    def refresh(self, people=None):
+        """
+        Recalculate the weights of the given people, or of everyone.
+
+        Args:
+        - people (iterable): The people whose cost changed, None for everyone
+        """
+        if people is None:
+            self.tree.rebuild(
+                [self.weight_function(person_id) for person_id in self.people]
+            )
+            return
+
+        for person_id in people:
+            position = self.position_dict.get(person_id)
+            if position is not None:
+                self.tree.update(position, self.weight_function(person_id))
+
+    def sample(self):
+        """Draw a person."""
+        if random.random() >= self.exploration_share:
+            total = self.tree.total()
+            if total > 0:
+                return self.people[self.tree.find(random.random() * total)]
+        return random.choice(self.people)
+
+
+def create_person_selector(
+    cost_evaluator,
+    schedule,
+    assigned_shifts,
+    people_data,
+    shifts_data,
+    guide_terms=None,
+    exploration_share=DEFAULT_EXPLORATION_SHARE,
+):
+    """
+    Create a cost guided selector over the scheduled people.
+
+    Args:
+    - cost_evaluator (IncrementalCostEvaluator): The evaluator caching the individual costs
+    - schedule (dict): The schedule, changed in place during the run
+    - assigned_shifts (dict): The shifts assigned to each person, changed in place
+    - people_data (dict): The people data
+    - shifts_data (dict): The shifts data
+    - guide_terms (list): Names of GUIDE_TERMS to weight by, None for the individual cost
+    - exploration_share (float): Share of uniformly drawn people
+
+    Returns:
+    - CostGuidedSelector: The selector
+    """
+    if guide_terms is None:
+
+        def weight_function(person_id):
+            return cost_evaluator.individual_costs[person_id]
+
+    else:
+        terms = [GUIDE_TERMS[name] for name in guide_terms]
+
+        def weight_function(person_id):
+            return sum(
+                term(
+                    schedule,
+                    person_id,
+                    assigned_shifts[person_id],
+                    people_data,
+                    shifts_data,
+                )
+                for term in terms
+            )
+
+    return CostGuidedSelector(assigned_shifts, weight_function, exploration_share)
@@ -1,20 +1,95 @@
+import gc
+import os
 import random
 import math
 import time
 import statistics
 from functools import partial
+from contextlib import contextmanager
 import concurrent.futures
+import multiprocessing
+from collections import Counter
+import numpy as np
 from excel_processing import create_file, load_excel_and_create_solution
 
-from cost_calculation import cost_function, individual_cost
-from utilities import showProgressIndicator
+from cost_calculation import explain_cost, individual_cost, cost_value
+from incremental_cost import IncrementalCostEvaluator
+from cost_cache import ZobristHasher, CostCache
+from assignment_counters import AssignmentCounters
+from move_selection import (
+    create_person_selector,
+    IndexedSet,
+    DEFAULT_EXPLORATION_SHARE,
+)
+from cooling import create_cooling_schedule, DEFAULT_REHEAT_FRACTION
+from vectorized_cost import batch_cost_function
+from utilities import showProgressIndicator, available_cpu_count
 
-from hard_constraints import get_neighbor
+from hard_constraints import get_neighbor, apply_move, undo_move
 
 from logger import logging
+from tracing import tracer
+from cancellation import is_cancelled
+from checkpoint import save_checkpoint, load_checkpoint, DEFAULT_CHECKPOINT_INTERVAL
+from island_model import (
+    IslandMigration,
+    ScheduleCodec,
+    create_island_memory,
+    DEFAULT_MIGRATION_INTERVAL,
+)
 
 from create_init import generate_initial_solution
 
+# Annealing steps every parallel tempering replica runs between two exchange rounds
+DEFAULT_EXCHANGE_INTERVAL = 100
+
+# Annealing steps every racing run gets between two checkpoints
+DEFAULT_CHECKPOINT_ITERATIONS = 1000
+# Share of the racing runs replaced by forks of the leaders at every checkpoint
+DEFAULT_KILL_FRACTION = 0.25
+
+# The problem data of a pool worker process, set once by init_worker
+worker_problem = {}
+
+
+def init_worker(people_data, shifts_data):
+    """Store the problem data in a pool worker (ProcessPoolExecutor initializer)."""
+    worker_problem["people_data"] = people_data
+    worker_problem["shifts_data"] = shifts_data
+
+
+@contextmanager
+def worker_pool(people_data, shifts_data, max_workers=None):
+    """
+    Create a process pool whose workers receive the problem data once.
+
+    The pool has max_workers workers, by default one per available CPU (see
+    utilities.available_cpu_count). Tasks run in the pool only carry their seed and
+    parameters and read the data from worker_problem. With the fork start method
+    (the default on Linux) the workers inherit the data without pickling it. The
+    garbage collector is frozen meanwhile so that collections do not touch the
+    inherited objects, which would copy their memory pages into every worker. With
+    other start methods the data is pickled once per worker instead of once per task.
+    """
+    if max_workers is None:
+        max_workers = available_cpu_count()
+
+    gc.freeze()
+    try:
+        with concurrent.futures.ProcessPoolExecutor(
+            max_workers, initializer=init_worker, initargs=(people_data, shifts_data)
+        ) as executor:
+            yield executor
+    finally:
+        gc.unfreeze()
+
+
+def annealing_task(*args, **kwargs):
+    """Run simulated_annealing in a worker_pool on the worker's problem data."""
+    return simulated_annealing(
+        worker_problem["people_data"], worker_problem["shifts_data"], *args, **kwargs
+    )
+
 
 def run_parallel_simulated_annealing(
     num_instances,
@@ -24,31 +99,405 @@ def run_parallel_simulated_annealing(
     cooling_rate,
     max_iterations_without_improvement,
     *args,
+    time_budget=None,
+    target_cost=None,
+    cancel_token=None,
+    mode="independent",
+    checkpoint_path=None,
+    resume=False,
     **kwargs,
 ):
-    best_solutions = []
-    with concurrent.futures.ProcessPoolExecutor() as executor:
-        seeds = [random.randint(0, 1000000) for _ in range(num_instances)]
-        annealing_function = partial(
-            simulated_annealing,
+    """
+    Run simulated annealing instances in parallel and keep the best result.
+
+    In the "independent" mode every instance is a separate simulated_annealing run.
+    time_budget is turned into one deadline for the whole run, which is passed to
+    every instance together with target_cost, cancel_token and further keyword
+    arguments, so instances that wait for a free worker do not extend the run. The cancel_token needs a process-shared event (see
+    cancellation.CancellationToken). With a checkpoint_path, every instance writes
+    its checkpoints to checkpoint_path with its number appended, and the number of
+    instances is kept in checkpoint_path with ".instances" appended. resume=True
+    continues every instance from its own checkpoint, with the number of instances
+    of the interrupted run instead of num_instances.
+
+    In the "tempering" mode the instances are the replicas of
+    run_parallel_tempering, in the "islands" mode the islands of
+    run_parallel_islands and in the "racing" mode the runs of run_parallel_racing,
+    which get the same arguments.
+    """
+    if mode != "independent" and (checkpoint_path is not None or resume):
+        raise ValueError("Checkpoints are only supported in the independent mode")
+
+    if mode == "racing":
+        return run_parallel_racing(
+            num_instances,
+            people_data,
+            shifts_data,
+            initial_temperature,
+            cooling_rate,
+            max_iterations_without_improvement,
+            time_budget=time_budget,
+            target_cost=target_cost,
+            cancel_token=cancel_token,
+            **kwargs,
+        )
+    if mode == "islands":
+        return run_parallel_islands(
+            num_instances,
+            people_data,
+            shifts_data,
+            initial_temperature,
+            cooling_rate,
+            max_iterations_without_improvement,
+            time_budget=time_budget,
+            target_cost=target_cost,
+            cancel_token=cancel_token,
+            **kwargs,
+        )
+    if mode == "tempering":
+        return run_parallel_tempering(
+            num_instances,
             people_data,
             shifts_data,
             initial_temperature,
             cooling_rate,
             max_iterations_without_improvement,
+            time_budget=time_budget,
+            target_cost=target_cost,
+            cancel_token=cancel_token,
+            **kwargs,
         )
+    if mode != "independent":
+        raise ValueError(f"Unknown parallel mode: {mode}")
 
-        futures = {executor.submit(annealing_function, seed): seed for seed in seeds}
+    deadline = time.time() + time_budget if time_budget is not None else None
+    if checkpoint_path is not None:
+        instances_path = f"{checkpoint_path}.instances"
+        if resume and os.path.exists(instances_path):
+            resumed_instances = load_checkpoint(instances_path)["num_instances"]
+            if resumed_instances != num_instances:
+                logging.info(
+                    f"Resuming {resumed_instances} instances instead of {num_instances}"
+                )
+            num_instances = resumed_instances
+        else:
+            save_checkpoint(instances_path, {"num_instances": num_instances})
 
-        for future in concurrent.futures.as_completed(futures):
-            seed = futures[future]
-            try:
-                result = future.result()
+    with worker_pool(people_data, shifts_data) as executor:
+        seeds = [random.randint(0, 1000000) for _ in range(num_instances)]
+        annealing_function = partial(
+            annealing_task,
+            initial_temperature,
+            cooling_rate,
+            max_iterations_without_improvement,
+            deadline=deadline,
+            target_cost=target_cost,
+            cancel_token=cancel_token,
+            resume=resume,
+            **kwargs,
+        )
+
+        futures = {}
+        for instance, seed in enumerate(seeds):
+            instance_options = {}
+            if checkpoint_path is not None:
+                instance_options["checkpoint_path"] = f"{checkpoint_path}.{instance}"
+            futures[executor.submit(annealing_function, seed, **instance_options)] = seed
+        best_solutions = collect_parallel_results(futures, cancel_token)
+
+    return choose_best_solution(best_solutions, people_data, shifts_data)
+
+
+def collect_parallel_results(futures, cancel_token=None):
+    """
+    Wait for parallel annealing runs and collect the schedules they found.
+
+    Once cancel_token is cancelled, the runs that have not started yet are dropped.
+
+    Args:
+    - futures (dict): The futures of the runs, mapped to their seeds
+    - cancel_token (CancellationToken): The token the runs honor, if any
+
+    Returns:
+    - list: The (schedule, assigned shifts, cost, initial cost) results
+    """
+    best_solutions = []
+    for future in concurrent.futures.as_completed(futures):
+        if is_cancelled(cancel_token):
+            for pending_future in futures:
+                pending_future.cancel()  # Instances that have not started yet
+
+        seed = futures[future]
+        if future.cancelled():
+            continue
+        try:
+            result = future.result()
+            if result[0] is not None:
                 best_solutions.append(result)
-            except Exception as e:
-                print(f"An error occurred with seed {seed}: {e}")
+        except Exception as e:
+            print(f"An error occurred with seed {seed}: {e}")
+    return best_solutions
+
+
+def run_parallel_racing(
+    num_runs,
+    people_data,
+    shifts_data,
+    initial_temperature,
+    cooling_rate,
+    max_iterations_without_improvement,
+    checkpoint_iterations=DEFAULT_CHECKPOINT_ITERATIONS,
+    kill_fraction=DEFAULT_KILL_FRACTION,
+    time_budget=None,
+    target_cost=None,
+    cancel_token=None,
+    **kwargs,
+):
+    """
+    Race parallel annealing runs and hand the budget of the worst ones to the leaders.
+
+    Every run anneals in segments of checkpoint_iterations steps (see racing_task),
+    each continuing from the best schedule of the previous segment at the
+    temperature the geometric schedule has reached by then. At every checkpoint the
+    kill_fraction of the runs with the highest best cost is dropped, and their
+    workers continue forks of the cheapest runs with new seeds instead. A run ends
+    once its temperature has dropped to 1. Since the race tracks that temperature
+    itself, the segments only support the geometric cooling schedule without
+    reheats, and kill_fraction has to be at least 0 and below 1.
+
+    The race stops early after time_budget seconds, once a run reaches target_cost
+    or once cancel_token is cancelled. Further keyword arguments are passed to every
+    simulated_annealing segment.
 
+    Returns:
+    - tuple: The best (schedule, assigned shifts, cost, initial cost) of all runs
+    """
+    if kwargs.get("cooling_schedule", "geometric") != "geometric" or kwargs.get(
+        "reheats", 0
+    ):
+        raise ValueError(
+            "Racing only supports the geometric cooling schedule without reheats"
+        )
+    if not 0 <= kill_fraction < 1:
+        raise ValueError(
+            f"kill_fraction must be at least 0 and below 1, not {kill_fraction}"
+        )
+
+    deadline = time.time() + time_budget if time_budget is not None else None
+    codec = ScheduleCodec(people_data, shifts_data)
+    segment_cooling = cooling_rate**checkpoint_iterations
+
+    # Every run holds its encoded best schedule, best cost, temperature and initial cost
+    runs = [
+        {
+            "encoded": None,
+            "cost": math.inf,
+            "temperature": initial_temperature,
+            "init_cost": None,
+        }
+        for _ in range(num_runs)
+    ]
+    finished_runs = []
+    checkpoints = 0
+
+    with worker_pool(people_data, shifts_data, num_runs) as executor:
+        while runs:
+            if is_cancelled(cancel_token) or (
+                deadline is not None and time.time() >= deadline
+            ):
+                logging.info("Racing stopped by cancellation or time limit")
+                break
+            best_cost = min(run["cost"] for run in runs)
+            if target_cost is not None and best_cost <= target_cost:
+                logging.info(f"Racing reached target cost {target_cost}")
+                break
+
+            futures = {
+                executor.submit(
+                    racing_task,
+                    run["encoded"],
+                    run["temperature"],
+                    cooling_rate,
+                    max_iterations_without_improvement,
+                    random.randint(0, 1000000),
+                    max_iterations=checkpoint_iterations,
+                    deadline=deadline,
+                    target_cost=target_cost,
+                    cancel_token=cancel_token,
+                    **kwargs,
+                ): run
+                for run in runs
+            }
+
+            active_runs = []
+            for future in concurrent.futures.as_completed(futures):
+                run = futures[future]
+                try:
+                    encoded, cost, init_cost = future.result()
+                except Exception as e:
+                    print(f"An error occurred in a racing run: {e}")
+                    continue
+                if encoded is None:
+                    continue  # No initial solution
+
+                run["encoded"] = encoded
+                run["cost"] = cost
+                run["temperature"] *= segment_cooling
+                if run["init_cost"] is None:
+                    run["init_cost"] = init_cost
+                if run["temperature"] > 1:
+                    active_runs.append(run)
+                else:
+                    finished_runs.append(run)
+            checkpoints += 1
+
+            # Drop the worst runs and fork the leaders into their workers
+            active_runs.sort(key=lambda run: run["cost"])
+            killed = int(len(active_runs) * kill_fraction)
+            runs = active_runs[: len(active_runs) - killed]
+            runs += [dict(runs[fork % len(runs)]) for fork in range(killed)]
+
+    logging.info(f"Racing finished after {checkpoints} checkpoints")
+
+    best_solutions = []
+    for run in finished_runs + runs:
+        if run["encoded"] is not None:
+            schedule, assigned_shifts = codec.decode(run["encoded"])
+            best_solutions.append(
+                (schedule, assigned_shifts, run["cost"], run["init_cost"])
+            )
+    return choose_best_solution(best_solutions, people_data, shifts_data)
+
+
+def racing_task(encoded, *args, **kwargs):
+    """
+    Run one simulated_annealing segment of run_parallel_racing in a worker_pool.
+
+    Args:
+    - encoded (np.ndarray): The ScheduleCodec encoded schedule to continue from,
+      None to start from a new initial solution
+    - args, kwargs: The arguments of simulated_annealing
+
+    Returns:
+    - np.ndarray: The encoded best schedule of the segment, None if there is none
+    - float: The cost of the best schedule
+    - float: The cost of the schedule the segment started from
+    """
+    codec = ScheduleCodec(worker_problem["people_data"], worker_problem["shifts_data"])
+    initial_solution = codec.decode(encoded) if encoded is not None else None
+    schedule, assigned_shifts, cost, init_cost = annealing_task(
+        *args, initial_solution=initial_solution, **kwargs
+    )
+    if schedule is None:
+        return None, None, None
+    return codec.encode(assigned_shifts), cost, init_cost
+
+
+def run_parallel_islands(
+    num_islands,
+    people_data,
+    shifts_data,
+    initial_temperature,
+    cooling_rate,
+    max_iterations_without_improvement,
+    migration_interval=DEFAULT_MIGRATION_INTERVAL,
+    time_budget=None,
+    **kwargs,
+):
+    """
+    Run annealing islands in parallel that migrate their best schedules.
+
+    Every island is a simulated_annealing run in a pool worker (see island_worker).
+    Every migration_interval steps it publishes its best schedule to its slot of a
+    shared memory block and adopts the best schedule of the next island on the ring
+    if that one is cheaper (see island_model.IslandMigration). All islands stop at
+    the same deadline, time_budget seconds from now. Keyword arguments are passed to
+    every simulated_annealing run.
+
+    Returns:
+    - tuple: The best (schedule, assigned shifts, cost, initial cost) of all islands
+    """
+    deadline = time.time() + time_budget if time_budget is not None else None
+    memory = create_island_memory(num_islands, people_data, shifts_data)
+    try:
+        # All islands have to run at the same time to exchange schedules
+        with worker_pool(people_data, shifts_data, num_islands) as executor:
+            futures = {}
+            for island in range(num_islands):
+                seed = random.randint(0, 1000000)
+                future = executor.submit(
+                    island_worker,
+                    memory.name,
+                    island,
+                    num_islands,
+                    migration_interval,
+                    initial_temperature,
+                    cooling_rate,
+                    max_iterations_without_improvement,
+                    seed,
+                    deadline=deadline,
+                    **kwargs,
+                )
+                futures[future] = seed
+            best_solutions = collect_parallel_results(
+                futures, kwargs.get("cancel_token")
+            )
+    finally:
+        memory.close()
+        memory.unlink()
+
+    return choose_best_solution(best_solutions, people_data, shifts_data)
+
+
+def island_worker(
+    memory_name,
+    island,
+    num_islands,
+    migration_interval,
+    *args,
+    **kwargs,
+):
+    """Run simulated_annealing as one island of run_parallel_islands in a worker_pool."""
+    migration = IslandMigration(
+        memory_name,
+        island,
+        num_islands,
+        worker_problem["people_data"],
+        worker_problem["shifts_data"],
+        migration_interval,
+    )
+    try:
+        return annealing_task(*args, migration=migration, **kwargs)
+    finally:
+        logging.info(
+            f"Island {island} adopted {migration.adopted} schedules from its neighbor"
+        )
+        migration.close()
+
+
+def choose_best_solution(best_solutions, people_data, shifts_data):
+    """
+    Re-score the results of parallel runs and return the cheapest one.
+
+    Args:
+    - best_solutions (list): The (schedule, assigned shifts, cost, initial cost) results
+    - people_data (dict): The people data
+    - shifts_data (dict): The shifts data
+
+    Returns:
+    - tuple: The cheapest result, or four times None if there is none
+    """
     if best_solutions:
+        # Re-score all candidate schedules in one vectorized call
+        batch_costs = batch_cost_function(
+            [solution[1] for solution in best_solutions], people_data, shifts_data
+        )
+        best_solutions = [
+            (schedule, assigned_shifts, float(cost), init_cost)
+            for (schedule, assigned_shifts, _, init_cost), cost in zip(
+                best_solutions, batch_costs
+            )
+        ]
         best_solutions.sort(key=lambda x: x[2])
         return (
             best_solutions[0][0],
@@ -61,6 +510,199 @@ def run_parallel_simulated_annealing(
         return None, None, None, None
 
 
+def run_parallel_tempering(
+    num_replicas,
+    people_data,
+    shifts_data,
+    initial_temperature,
+    cooling_rate,
+    max_iterations_without_improvement,
+    min_temperature=1,
+    exchange_interval=DEFAULT_EXCHANGE_INTERVAL,
+    time_budget=None,
+    target_cost=None,
+    cancel_token=None,
+    **state_options,
+):
+    """
+    Run replicas at a fixed ladder of temperatures that exchange their states.
+
+    The temperatures are spaced geometrically from min_temperature up to
+    initial_temperature and every replica runs in its own process (see
+    tempering_worker). This process coordinates them: after every replica ran
+    exchange_interval steps, neighbors on the ladder (alternately the even and the
+    odd pairs) swap their temperatures with the probability
+    min(1, exp((1 / T_cold - 1 / T_hot) * (cost_cold - cost_hot))), which hands the
+    cheaper state to the colder temperature. Swapping the temperatures instead of
+    the schedules exchanges the states without sending them between processes.
+
+    Every replica gets as many steps as a geometric simulated annealing run with
+    cooling_rate, and the run ends early once the best cost has not improved for
+    max_iterations_without_improvement steps, after time_budget seconds, once it
+    reaches target_cost or once cancel_token is cancelled. Further keyword arguments
+    are passed to the AnnealingState of every replica.
+
+    Returns:
+    - tuple: The best (schedule, assigned shifts, cost, initial cost) of all replicas
+    """
+    deadline = time.time() + time_budget if time_budget is not None else None
+    if num_replicas > 1:
+        temperatures = [
+            min_temperature
+            * (initial_temperature / min_temperature) ** (rung / (num_replicas - 1))
+            for rung in range(num_replicas)
+        ]
+    else:
+        temperatures = [min_temperature]
+    max_rounds = math.ceil(
+        math.log(1 / initial_temperature) / math.log(cooling_rate) / exchange_interval
+    )
+
+    connections = []
+    workers = []
+    for _ in range(num_replicas):
+        connection, worker_connection = multiprocessing.Pipe()
+        worker = multiprocessing.Process(
+            target=tempering_worker,
+            args=(
+                worker_connection,
+                people_data,
+                shifts_data,
+                random.randint(0, 1000000),
+                cancel_token,
+                deadline,
+                state_options,
+            ),
+            daemon=True,
+        )
+        worker.start()
+        connections.append(connection)
+        workers.append(worker)
+
+    try:
+        init_costs = [connection.recv() for connection in connections]
+        if any(init_cost is None for init_cost in init_costs):
+            print("No valid solutions found.")
+            return None, None, None, None
+
+        # replica_at[rung] is the replica currently running at temperatures[rung]
+        replica_at = list(range(num_replicas))
+        exchange_stats = Counter()
+        best_cost = min(init_costs)
+        rounds_without_improvement = 0
+
+        for round_number in range(max_rounds):
+            if is_cancelled(cancel_token) or (
+                deadline is not None and time.time() >= deadline
+            ):
+                logging.info("Parallel tempering stopped by cancellation or time limit")
+                break
+            if target_cost is not None and best_cost <= target_cost:
+                logging.info(f"Parallel tempering reached target cost {target_cost}")
+                break
+            if rounds_without_improvement * exchange_interval >= (
+                max_iterations_without_improvement
+            ):
+                break
+
+            for rung, replica in enumerate(replica_at):
+                connections[replica].send(("run", temperatures[rung], exchange_interval))
+            reports = [connection.recv() for connection in connections]
+            current_costs = [current_cost for current_cost, _ in reports]
+
+            round_best_cost = min(replica_best_cost for _, replica_best_cost in reports)
+            if round_best_cost < best_cost:
+                best_cost = round_best_cost
+                rounds_without_improvement = 0
+            else:
+                rounds_without_improvement += 1
+
+            for rung in range(round_number % 2, num_replicas - 1, 2):
+                cold_replica = replica_at[rung]
+                hot_replica = replica_at[rung + 1]
+                exponent = (1 / temperatures[rung] - 1 / temperatures[rung + 1]) * (
+                    current_costs[cold_replica] - current_costs[hot_replica]
+                )
+                exchange_stats["proposed"] += 1
+                if exponent >= 0 or random.random() < math.exp(exponent):
+                    replica_at[rung], replica_at[rung + 1] = hot_replica, cold_replica
+                    exchange_stats["accepted"] += 1
+
+        if exchange_stats["proposed"] > 0:
+            logging.info(
+                f"Replica exchanges: {exchange_stats['proposed']}, accepted: "
+                f"{exchange_stats['accepted']} "
+                f"({exchange_stats['accepted'] / exchange_stats['proposed'] * 100:.1f}%)"
+            )
+
+        best_solutions = []
+        for connection, init_cost in zip(connections, init_costs):
+            connection.send(("best",))
+            schedule, assigned_shifts, cost = connection.recv()
+            best_solutions.append((schedule, assigned_shifts, cost, init_cost))
+    finally:
+        for connection in connections:
+            try:
+                connection.send(("stop",))
+            except (BrokenPipeError, OSError):
+                pass  # The worker has already exited
+        for worker in workers:
+            worker.join(timeout=5)
+            if worker.is_alive():
+                worker.terminate()
+
+    return choose_best_solution(best_solutions, people_data, shifts_data)
+
+
+def tempering_worker(
+    connection, people_data, shifts_data, seed, cancel_token, deadline, state_options
+):
+    """
+    Run one parallel tempering replica, driven by commands from the coordinator.
+
+    The worker first sends the cost of its initial solution (None if none was
+    found before the deadline of the coordinator). Then it answers ("run",
+    temperature, steps) with its current and best cost after the steps and
+    ("best",) with its best (schedule, assigned shifts, cost), until it receives
+    ("stop",).
+    """
+    random.seed(seed)
+    schedule, assigned_shifts = generate_initial_solution(
+        shifts_data, people_data, cancel_token, deadline
+    )
+    if schedule is None:
+        connection.send(None)
+        return
+
+    state = AnnealingState(
+        schedule,
+        assigned_shifts,
+        cost_value(schedule, assigned_shifts, people_data, shifts_data),
+        people_data,
+        shifts_data,
+        **state_options,
+    )
+    connection.send(state.current_cost)
+
+    while True:
+        command = connection.recv()
+        if command[0] == "run":
+            _, temperature, steps = command
+            for _ in range(steps):
+                if state.step(temperature) is None:
+                    break  # No valid neighbor left to explore
+            connection.send((state.current_cost, state.best_cost))
+        elif command[0] == "best":
+            connection.send(
+                (state.best_schedule, state.best_assigned_shifts, state.best_cost)
+            )
+        else:
+            break
+
+    state.log_proposal_stats()
+    tracer.flush()
+
+
 def simulated_annealing(
     people_data,
     shifts_data,
@@ -68,85 +710,515 @@ def simulated_annealing(
     cooling_rate,
     max_iterations_without_improvement,
     seed=None,
+    guide_terms=None,
+    exploration_share=DEFAULT_EXPLORATION_SHARE,
+    batch_size=1,
+    batch_choice="roulette",
+    time_budget=None,
+    deadline=None,
+    target_cost=None,
+    cancel_token=None,
+    cooling_schedule="geometric",
+    cooling_options=None,
+    reheats=0,
+    reheat_fraction=DEFAULT_REHEAT_FRACTION,
+    migration=None,
+    initial_solution=None,
+    max_iterations=None,
+    checkpoint_path=None,
+    checkpoint_interval=DEFAULT_CHECKPOINT_INTERVAL,
+    resume=False,
 ):
+    """
+    Improve an initial solution with simulated annealing.
+
+    The temperature follows cooling_schedule, one of cooling.COOLING_SCHEDULES
+    (created with cooling_options). Once the schedule has finished or
+    max_iterations_without_improvement is reached, the run goes back to the best
+    schedule and restarts at reheat_fraction of the initial temperature, up to
+    reheats times, before it ends.
+
+    Besides that, the run stops after time_budget seconds, at deadline (a time.time()
+    timestamp, which the parallel runs share), once a schedule costs at most
+    target_cost or once cancel_token is cancelled. Both limits include creating the
+    initial solution. It always returns the best schedule found so far.
+
+    If an island_model.IslandMigration is given as migration, it exchanges the best
+    schedule with the other islands every migration.interval steps.
+
+    The run starts from initial_solution, a (schedule, assigned shifts) tuple, if
+    given, instead of generating one, and ends after max_iterations steps, if given.
+
+    With a checkpoint_path, the run writes a checkpoint every checkpoint_interval
+    seconds and when it ends (see write_checkpoint). With resume=True, it continues
+    from that checkpoint if it exists: from the same current and best schedule,
+    temperature, counters and random state. The cost caches are recalculated, so
+    the costs may differ in the last digits from an uninterrupted run.
+
+    Returns:
+    - dict: The best schedule, or None if no initial solution was found
+    - dict: The shifts assigned to each person in the best schedule
+    - float: The cost of the best schedule
+    - float: The cost of the initial solution
+    """
     if seed is not None:
         random.seed(seed)
 
-    current_schedule, current_assigned_shifts = generate_initial_solution(
-        shifts_data, people_data
-    )
+    if time_budget is not None:
+        budget_deadline = time.time() + time_budget
+        deadline = budget_deadline if deadline is None else min(deadline, budget_deadline)
 
+    checkpoint = None
+    if resume and checkpoint_path is not None and os.path.exists(checkpoint_path):
+        checkpoint = load_checkpoint(checkpoint_path)
+        if set(checkpoint["assigned_shifts"]) != set(people_data["name_dict"]) or set(
+            checkpoint["schedule"]
+        ) != set(shifts_data["shift_time_dict"]):
+            raise ValueError(
+                f"The checkpoint {checkpoint_path} belongs to different people or shifts"
+            )
 
-    current_cost, total_cost_breakdown, cost_details = cost_function(
-        current_schedule, current_assigned_shifts, people_data, shifts_data
-    )
+    if checkpoint is not None:
+        current_schedule = checkpoint["schedule"]
+        current_assigned_shifts = checkpoint["assigned_shifts"]
+        current_cost = checkpoint["current_cost"]
+    elif initial_solution is not None:
+        current_schedule, current_assigned_shifts = initial_solution
+        current_cost = cost_value(
+            current_schedule, current_assigned_shifts, people_data, shifts_data
+        )
+    else:
+        current_schedule, current_assigned_shifts = generate_initial_solution(
+            shifts_data, people_data, cancel_token, deadline
+        )
+        if current_schedule is None:
+            return None, None, None, None
 
 
-    create_file(
+        current_cost, total_cost_breakdown, cost_details = explain_cost(
+            current_schedule, current_assigned_shifts, people_data, shifts_data
+        )
+
+
+        create_file(
+            current_schedule,
+            total_cost_breakdown,
+            people_data,
+            shifts_data,
+            cost_details,
+        )
+
+    state = AnnealingState(
         current_schedule,
-        total_cost_breakdown,
+        current_assigned_shifts,
+        current_cost,
         people_data,
         shifts_data,
-        cost_details,
+        guide_terms,
+        exploration_share,
+        batch_size,
+        batch_choice,
     )
-    
+
     init_cost = current_cost
-    temperature = initial_temperature
+    cooling = create_cooling_schedule(
+        cooling_schedule, initial_temperature, cooling_rate, **(cooling_options or {})
+    )
+    reheats_left = reheats
     iterations_without_improvement = 0
 
-    total_iterations = math.ceil(
-        math.log(1 / initial_temperature) / math.log(cooling_rate)
-    )
+    current_iteration = 0
+
+    if checkpoint is not None:
+        state.best_schedule = checkpoint["best_schedule"]
+        state.best_assigned_shifts = checkpoint["best_assigned_shifts"]
+        state.best_cost = checkpoint["best_cost"]
+        init_cost = checkpoint["init_cost"]
+        cooling = checkpoint["cooling"]
+        reheats_left = checkpoint["reheats_left"]
+        iterations_without_improvement = checkpoint["iterations_without_improvement"]
+        current_iteration = checkpoint["current_iteration"]
+        random.setstate(checkpoint["random_state"])
+        # The order of the understaffed shifts depends on the moves made so far
+        state.cost_evaluator.understaffed_shifts = IndexedSet(
+            checkpoint["understaffed_shifts"]
+        )
+        logging.info(
+            f"Resuming simulated annealing from {checkpoint_path} at iteration "
+            f"{current_iteration} with cost {state.current_cost:.1f}"
+        )
+
+    total_iterations = cooling.total_iterations * (reheats + 1)
     start_time = time.time()
     last_progress_time = start_time
-    current_iteration = 0
+    last_log_time = start_time
+    last_checkpoint_time = start_time
     
-    while (
-        temperature > 1
-        and iterations_without_improvement < max_iterations_without_improvement
+    try:
+        while True:
+            if (
+                cooling.finished()
+                or iterations_without_improvement >= max_iterations_without_improvement
+            ):
+                if reheats_left == 0:
+                    break
+                reheats_left -= 1
+
+                # Continue from the best schedule instead of the current one
+                state.restore_best()
+                cooling.reheat(initial_temperature * reheat_fraction)
+                iterations_without_improvement = 0
+                logging.info(
+                    f"Reheating to {cooling.temperature:.1f} from cost "
+                    f"{state.best_cost:.1f} ({reheats_left} reheats left)"
+                )
+
+            if is_cancelled(cancel_token) or (
+                deadline is not None and time.time() >= deadline
+            ):
+                logging.info("Simulated annealing stopped by cancellation or time limit")
+                break
+            if target_cost is not None and state.best_cost <= target_cost:
+                logging.info(f"Simulated annealing reached target cost {target_cost}")
+                break
+            if max_iterations is not None and current_iteration >= max_iterations:
+                break
+
+            accepted = state.step(cooling.temperature)
+            if accepted is None:
+                break  # No valid neighbor left to explore
+
+            if accepted:
+                iterations_without_improvement = 0
+            else:
+                iterations_without_improvement += 1
+
+            cooling.step(accepted, state.current_cost)
+            current_iteration += 1
+            if migration is not None and current_iteration % migration.interval == 0:
+                if migration.migrate(state):
+                    iterations_without_improvement = 0
+            # Check if 5 seconds have passed since the last progress indicator
+            current_time = time.time()
+            if current_time - last_progress_time >= 5:
+                showProgressIndicator(
+                    current_iteration,
+                    total_iterations,
+                    start_time,
+                    state.last_proposed_cost,
+                    init_cost,
+                )
+                last_progress_time = current_time
+
+            if current_time - last_log_time >= 30:
+                logging.info(
+                    "Progress: %.2f%% | Current Cost: %.1f",
+                    current_iteration / total_iterations * 100,
+                    state.last_proposed_cost,
+                )
+                last_log_time = current_time
+
+            if (
+                checkpoint_path is not None
+                and current_time - last_checkpoint_time >= checkpoint_interval
+            ):
+                write_checkpoint(
+                    checkpoint_path,
+                    state,
+                    cooling,
+                    init_cost,
+                    reheats_left,
+                    iterations_without_improvement,
+                    current_iteration,
+                )
+                last_checkpoint_time = current_time
+    except Exception:
+        tracer.flush()  # Write the trace events leading up to the failure
+        raise
+
+    logging.info(f"Cost cache after {current_iteration} iterations: {state.cost_cache}")
+    state.log_proposal_stats()
+
+    if checkpoint_path is not None:
+        # A resumed finished run returns its best schedule right away
+        write_checkpoint(
+            checkpoint_path,
+            state,
+            cooling,
+            init_cost,
+            reheats_left,
+            iterations_without_improvement,
+            current_iteration,
+        )
+
+    tracer.flush()
+
+    return state.best_schedule, state.best_assigned_shifts, state.best_cost, init_cost
+
+
+def write_checkpoint(
+    path,
+    state,
+    cooling,
+    init_cost,
+    reheats_left,
+    iterations_without_improvement,
+    current_iteration,
+):
+    """
+    Write the state of a simulated_annealing run between two iterations.
+
+    The checkpoint holds the current and best schedule with their costs, the
+    cooling schedule (with its temperature), the counters of the run, the state of
+    the random number generator and the order of the understaffed shifts the moves
+    are drawn from, which is everything the run depends on besides the problem
+    data and its arguments.
+    """
+    save_checkpoint(
+        path,
+        {
+            "schedule": state.schedule,
+            "assigned_shifts": state.assigned_shifts,
+            "current_cost": state.current_cost,
+            "best_schedule": state.best_schedule,
+            "best_assigned_shifts": state.best_assigned_shifts,
+            "best_cost": state.best_cost,
+            "init_cost": init_cost,
+            "cooling": cooling,
+            "reheats_left": reheats_left,
+            "iterations_without_improvement": iterations_without_improvement,
+            "current_iteration": current_iteration,
+            "random_state": random.getstate(),
+            "understaffed_shifts": list(state.cost_evaluator.understaffed_shifts),
+        },
+    )
+
+
+class AnnealingState:
+    """
+    A schedule under annealing, the caches used to step it and the best schedule seen.
+
+    The schedule and assigned shifts are changed in place by step(), which proposes
+    a neighbor (or, with batch_size > 1, picks one of a scored batch, see
+    choose_candidate) and accepts it with the Metropolis criterion at the given
+    temperature. The best schedule is kept as a copy.
+    """
+
+    def __init__(
+        self,
+        schedule,
+        assigned_shifts,
+        current_cost,
+        people_data,
+        shifts_data,
+        guide_terms=None,
+        exploration_share=DEFAULT_EXPLORATION_SHARE,
+        batch_size=1,
+        batch_choice="roulette",
     ):
+        self.schedule = schedule
+        self.assigned_shifts = assigned_shifts
+        self.people_data = people_data
+        self.shifts_data = shifts_data
+        self.batch_size = batch_size
+        self.batch_choice = batch_choice
 
-        new_schedule, new_assigned_shifts = get_neighbor(
-            current_schedule,
-            current_assigned_shifts,
-            shifts_data,
+        # Track who works which shift and the shift type counts per person for the
+        # hard constraints and the cost terms
+        self.counters = AssignmentCounters(schedule, people_data, shifts_data)
+
+        # Cache the cost terms so that each move only recomputes what it touches
+        self.cost_evaluator = IncrementalCostEvaluator(
+            schedule, assigned_shifts, people_data, shifts_data, self.counters
+        )
+
+        # Draw the people to move in proportion to their cost (guide_terms, if given,
+        # restricts it to those individual cost terms) with some uniform exploration
+        self.person_selector = create_person_selector(
+            self.cost_evaluator,
+            schedule,
+            assigned_shifts,
             people_data,
+            shifts_data,
+            guide_terms,
+            exploration_share,
         )
-        new_cost, new_cost_breakdown, cost_details = cost_function(
-            new_schedule, new_assigned_shifts, people_data, shifts_data
+
+        # Remember the cost of visited schedules so re-proposed ones skip the evaluation
+        self.schedule_hasher = ZobristHasher(people_data, shifts_data)
+        self.cost_cache = CostCache()
+        self.current_cost = current_cost
+        self.current_hash = self.schedule_hasher.hash_schedule(assigned_shifts)
+        self.cost_cache.put(self.current_hash, current_cost)
+        self.last_proposed_cost = current_cost
+
+        # Count how many neighbor proposals violate a hard constraint
+        self.proposal_stats = Counter()
+
+        # The current solution changes in place, so the best one is kept as a copy
+        self.best_schedule, self.best_assigned_shifts = copy_solution(
+            schedule, assigned_shifts
         )
+        self.best_cost = current_cost
+
+    def _score_move(self, move):
+        """Look up or evaluate the cost of an applied move, leaving it pending if evaluated."""
+        new_hash = self.schedule_hasher.apply_move(self.current_hash, move)
+        new_cost = self.cost_cache.get(new_hash)
+        evaluated = new_cost is None
+        if evaluated:
+            new_cost = self.current_cost + self.cost_evaluator.evaluate_move(
+                self.schedule, self.assigned_shifts, move
+            )
+            self.cost_cache.put(new_hash, new_cost)
+        return new_hash, new_cost, evaluated
+
+    def step(self, temperature):
+        """
+        Propose a move and accept or reject it at the given temperature.
+
+        Returns:
+        - bool: Whether the move was accepted, None if no valid neighbor was found
+        """
+        neighbor_options = {
+            "understaffed_shifts": self.cost_evaluator.understaffed_shifts,
+            "proposal_stats": self.proposal_stats,
+            "counters": self.counters,
+            "person_selector": self.person_selector,
+        }
+
+        if self.batch_size > 1:
+            # Score a batch of candidate moves, the chosen one goes up for acceptance
+            candidates = []
+            for _ in range(self.batch_size):
+                move, undo = get_neighbor(
+                    self.schedule,
+                    self.assigned_shifts,
+                    self.shifts_data,
+                    self.people_data,
+                    **neighbor_options,
+                )
+                if move is None:
+                    break
+
+                new_hash, new_cost, evaluated = self._score_move(move)
+                if evaluated:
+                    self.cost_evaluator.reject()
+                undo_move(self.schedule, self.assigned_shifts, undo, self.counters)
+                candidates.append((move, new_hash, new_cost))
 
-        if (
+            if not candidates:
+                return None
+
+            move, new_hash, new_cost = choose_candidate(
+                candidates, temperature, self.batch_choice
+            )
+            undo = apply_move(self.schedule, self.assigned_shifts, move, self.counters)
+            evaluated = False
+        else:
+            # The move is applied in place and undone again if it is rejected
+            move, undo = get_neighbor(
+                self.schedule,
+                self.assigned_shifts,
+                self.shifts_data,
+                self.people_data,
+                **neighbor_options,
+            )
+            if move is None:
+                return None
+
+            new_hash, new_cost, evaluated = self._score_move(move)
+
+        self.last_proposed_cost = new_cost
+        accepted = (
             acceptance_probability(
-                current_cost,
+                self.current_cost,
                 new_cost,
                 temperature,
             )
             > random.random()
-        ):
-            current_schedule = new_schedule
-            current_assigned_shifts = new_assigned_shifts
-            current_cost = new_cost
-            iterations_without_improvement = 0
+        )
+        if accepted:
+            if not evaluated:
+                # The cached cost decided the acceptance, the cost terms need the move
+                self.cost_evaluator.evaluate_move(
+                    self.schedule, self.assigned_shifts, move
+                )
+            self.current_cost = self.cost_evaluator.accept()
+            self.person_selector.refresh(self.cost_evaluator.last_updated_people)
+            self.current_hash = new_hash
+            if self.current_cost < self.best_cost:
+                self.best_schedule, self.best_assigned_shifts = copy_solution(
+                    self.schedule, self.assigned_shifts
+                )
+                self.best_cost = self.current_cost
         else:
-            iterations_without_improvement += 1
-
-        temperature *= cooling_rate
-        current_iteration += 1
-        # Check if 5 seconds have passed since the last progress indicator
-        current_time = time.time()
-        if current_time - last_progress_time >= 5:
-            showProgressIndicator(
-                current_iteration, total_iterations, start_time, new_cost, init_cost
-            )
-            
-        if current_time - last_progress_time >= 30:
+            self.cost_evaluator.reject()
+            undo_move(self.schedule, self.assigned_shifts, undo, self.counters)
+        return accepted
+
+    def restore_best(self):
+        """Continue from the best schedule seen, recalculating every cache."""
+        restore_solution(
+            self.schedule,
+            self.assigned_shifts,
+            self.best_schedule,
+            self.best_assigned_shifts,
+        )
+        self.counters.reset(self.schedule)
+        self.current_cost = self.cost_evaluator.reset(
+            self.schedule, self.assigned_shifts
+        )
+        self.person_selector.refresh()
+        self.current_hash = self.schedule_hasher.hash_schedule(self.assigned_shifts)
+
+    def log_proposal_stats(self):
+        if self.proposal_stats["proposals"] > 0:
             logging.info(
-                f"Progress: {current_iteration / total_iterations * 100:.2f}% | Current Cost: {new_cost:.1f}"
+                f"Neighbor proposals: {self.proposal_stats['proposals']}, rejected: "
+                f"{self.proposal_stats['rejected']} "
+                f"({self.proposal_stats['rejected'] / self.proposal_stats['proposals'] * 100:.1f}%)"
             )
-        
 
-    return current_schedule, current_assigned_shifts, current_cost, init_cost
+
+def copy_solution(schedule, assigned_shifts):
+    """Copy a schedule and its assigned shifts, which only hold lists of IDs."""
+    return (
+        {shift_id: list(shift) for shift_id, shift in schedule.items()},
+        {person_id: list(shifts) for person_id, shifts in assigned_shifts.items()},
+    )
+
+
+def restore_solution(schedule, assigned_shifts, saved_schedule, saved_assigned_shifts):
+    """Overwrite a schedule and its assigned shifts in place with a copy_solution copy."""
+    for shift_id, shift in saved_schedule.items():
+        schedule[shift_id][:] = shift
+    for person_id, shifts in saved_assigned_shifts.items():
+        assigned_shifts[person_id][:] = shifts
+
+
+def choose_candidate(candidates, temperature, batch_choice="roulette"):
+    """
+    Choose one of a batch of scored candidate moves.
+
+    Args:
+    - candidates (list): The (move, schedule hash, cost) tuples of the candidates
+    - temperature (float): The current temperature
+    - batch_choice (str): "best" for the cheapest candidate, "roulette" for a draw
+      with Boltzmann weights exp(-(cost - lowest cost) / temperature)
+
+    Returns:
+    - tuple: The chosen (move, schedule hash, cost) tuple
+    """
+    if batch_choice == "best":
+        return min(candidates, key=lambda candidate: candidate[2])
+    if batch_choice != "roulette":
+        raise ValueError(f"Unknown batch choice: {batch_choice}")
+
+    costs = np.array([candidate[2] for candidate in candidates], dtype=float)
+    weights = np.exp(-(costs - costs.min()) / temperature)
+    chosen = random.choices(range(len(candidates)), weights=weights, k=1)[0]
+    return candidates[chosen]
 
 
 def acceptance_probability(old_cost, new_cost, temperature):
@@ -0,0 +1,72 @@
+import os
+import time
+from collections import deque
+from logger import logging
+
+# Record every n-th trace event, 0 disables tracing (can be set in the environment)
+DEFAULT_TRACE_SAMPLE_EVERY = int(os.environ.get("SCHEDULE_TRACE_SAMPLE_EVERY", 0))
+DEFAULT_TRACE_CAPACITY = 10000
+
+
+class Tracer:
+    """
+    Sampled in-memory tracing for hot paths.
+
+    Trace events are kept unformatted in a ring buffer holding the most recent
+    capacity events and are only formatted and written to the log on flush(). Call
+    sites guard on enabled, so no arguments are built while tracing is off:
+
+        if tracer.enabled:
+            tracer.trace("Moved %s to %s", person_id, shift_id)
+
+    Arguments are formatted on flush, so pass immutable values rather than objects
+    that change in place (like the schedule).
+    """
+
+    def __init__(
+        self, sample_every=DEFAULT_TRACE_SAMPLE_EVERY, capacity=DEFAULT_TRACE_CAPACITY
+    ):
+        self.configure(sample_every, capacity)
+
+    def configure(self, sample_every=None, capacity=None):
+        """
+        Change the sampling or the capacity of the ring buffer.
+
+        Args:
+        - sample_every (int): Record every n-th event, 0 disables tracing
+        - capacity (int): The number of events kept in the ring buffer
+        """
+        if sample_every is not None:
+            self.sample_every = sample_every
+        if capacity is not None:
+            self.events = deque(maxlen=capacity)
+        self.enabled = self.sample_every > 0
+        self.event_count = 0
+
+    def trace(self, message, *args):
+        """Record an event, if it is sampled."""
+        self.event_count += 1
+        if self.event_count % self.sample_every == 0:
+            self.events.append((time.time(), message, args))
+
+    def flush(self, level=logging.INFO):
+        """
+        Write the buffered events to the log and clear the buffer.
+
+        Returns:
+        - int: The number of written events
+        """
+        flushed = len(self.events)
+        while self.events:
+            event_time, message, args = self.events.popleft()
+            logging.log(
+                level,
+                "[trace %s] " + message,
+                time.strftime("%H:%M:%S", time.localtime(event_time)),
+                *args,
+            )
+        return flushed
+
+
+# The tracer shared by all modules of a process
+tracer = Tracer()
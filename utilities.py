@@ -1,3 +1,5 @@
+import math
+import os
 import time
 
 
@@ -77,3 +79,40 @@ def showInitProgressIndicator(
         end="\r",  # Ensures the output is flushed immediately
     )
 
+
+
+def available_cpu_count():
+    """
+    Count the CPUs this process may use.
+
+    Takes the smallest of the CPU affinity of the process and the CPU quota of its
+    cgroup (v2 cpu.max or v1 cpu.cfs_quota_us), so containers get their limit
+    instead of the CPU count of the host.
+
+    Returns:
+        int: The number of usable CPUs, at least 1.
+    """
+    if hasattr(os, "sched_getaffinity"):
+        cpu_count = len(os.sched_getaffinity(0))
+    else:
+        cpu_count = os.cpu_count() or 1
+
+    quota_files = [
+        ("/sys/fs/cgroup/cpu.max", None),
+        ("/sys/fs/cgroup/cpu/cpu.cfs_quota_us", "/sys/fs/cgroup/cpu/cpu.cfs_period_us"),
+    ]
+    for quota_path, period_path in quota_files:
+        try:
+            with open(quota_path) as quota_file:
+                values = quota_file.read().split()
+            if period_path is not None:
+                with open(period_path) as period_file:
+                    values.append(period_file.read().strip())
+        except OSError:
+            continue
+        quota, period = values[0], values[1]
+        if quota not in ("max", "-1") and int(period) > 0:
+            cpu_count = min(cpu_count, math.ceil(int(quota) / int(period)))
+        break
+
+    return max(cpu_count, 1)
@@ -0,0 +1,342 @@
+import numpy as np
+from cost_calculation import (
+    BALANCE_FACTOR,
+    ENEMY_FACTOR,
+    EXPERIENCE_FACTOR,
+    FRIEND_FACTOR,
+    GENDER_DISTRIBUTION_FACTOR,
+    MANDATORY_FACTOR,
+    NIGHT_SHIFT_FACTOR,
+    OFF_DAY_FACTOR,
+    SAME_TIME_FACTOR,
+    SHIFT_RANKING_FACTOR,
+    SHIFT_TYPE_FACTOR,
+    USE_EXPERIENCE_COST,
+)
+
+
+def build_cost_arrays(people_data, shifts_data):
+    """
+    Build the arrays needed to evaluate schedules as people x shifts assignment matrices.
+
+    Rows follow people_data["person_index_dict"] and columns follow
+    shifts_data["shift_index_dict"]. The arrays only depend on the input data, so
+    they are built once and reused for every evaluated schedule.
+
+    Args:
+    - people_data (dict): The people data (including transform_person_shift_data)
+    - shifts_data (dict): The shifts data
+
+    Returns:
+    - dict: The cost arrays
+    """
+    person_index_dict = people_data["person_index_dict"]
+    shift_index_dict = shifts_data["shift_index_dict"]
+    num_people = len(person_index_dict)
+    num_shifts = len(shift_index_dict)
+    shift_time_dict = shifts_data["shift_time_dict"]
+
+    # Friend/enemy adjacency (a person never counts as their own colleague)
+    friend_matrix = np.zeros((num_people, num_people))
+    enemy_matrix = np.zeros((num_people, num_people))
+    friend_count = np.zeros(num_people)
+    for person, row in person_index_dict.items():
+        friend_set = people_data["friend_dict"].get(person, frozenset())
+        enemy_set = people_data["enemy_dict"].get(person, frozenset())
+        friend_count[row] = len(friend_set)
+        for colleague in friend_set:
+            if colleague in person_index_dict and colleague != person:
+                friend_matrix[row, person_index_dict[colleague]] = 1
+        for colleague in enemy_set:
+            if colleague in person_index_dict and colleague != person:
+                enemy_matrix[row, person_index_dict[colleague]] = 1
+
+    # Shifts starting at the same time (including the shift itself) and night shifts
+    shift_start = np.zeros(num_shifts)
+    night_vector = np.zeros(num_shifts)
+    for shift, column in shift_index_dict.items():
+        shift_start[column] = shift_time_dict[shift][0]
+        if shifts_data["shift_attribute_dict"][shift]["is_night"]:
+            night_vector[column] = 1
+    same_time_matrix = (shift_start[:, None] == shift_start[None, :]).astype(float)
+
+    # Shift type counts and the per person shift type limits
+    shift_types = {shifts_data["shift_type_dict"].get(shift, 0) for shift in shift_index_dict}
+    for person_shift_types in people_data["people_shift_types_dict"].values():
+        shift_types.update(person_shift_types)
+    type_index_dict = {shift_type: index for index, shift_type in enumerate(shift_types)}
+
+    shift_type_matrix = np.zeros((num_shifts, len(type_index_dict)))
+    for shift, column in shift_index_dict.items():
+        shift_type_matrix[
+            column, type_index_dict[shifts_data["shift_type_dict"].get(shift, 0)]
+        ] = 1
+
+    type_listed = np.zeros((num_people, len(type_index_dict)), dtype=bool)
+    type_min = np.zeros((num_people, len(type_index_dict)))
+    type_max = np.zeros((num_people, len(type_index_dict)))
+    for person, row in person_index_dict.items():
+        person_shift_types = people_data["people_shift_types_dict"].get(person, {})
+        for shift_type, (_, min_required, max_allowed) in person_shift_types.items():
+            type_listed[row, type_index_dict[shift_type]] = True
+            type_min[row, type_index_dict[shift_type]] = min_required
+            type_max[row, type_index_dict[shift_type]] = max_allowed
+
+    # One row per distinct mandatory period, owned by a person
+    mandatory_rows = []
+    mandatory_owner = []
+    mandatory_required = np.zeros(num_people)
+    for person, row in person_index_dict.items():
+        mandatory_periods = people_data["mandatory_dict"].get(person, [])
+        mandatory_required[row] = len(mandatory_periods)
+        for mandatory_start, mandatory_end in set(mandatory_periods):
+            period_row = np.zeros(num_shifts)
+            for shift, column in shift_index_dict.items():
+                start, end = shift_time_dict[shift]
+                if start >= mandatory_start and end <= mandatory_end:
+                    period_row[column] = 1
+            mandatory_rows.append(period_row)
+            mandatory_owner.append(row)
+    mandatory_matrix = np.array(mandatory_rows).reshape(len(mandatory_rows), num_shifts)
+    mandatory_owner_matrix = np.zeros((len(mandatory_owner), num_people))
+    mandatory_owner_matrix[np.arange(len(mandatory_owner)), mandatory_owner] = 1
+
+    # Shift capacities, priorities, genders and experience
+    min_capacity = np.zeros(num_shifts)
+    priority_penalty = np.zeros(num_shifts)
+    for shift, column in shift_index_dict.items():
+        min_capacity[column] = shifts_data["shift_capacity_dict"][shift][0]
+        priority_penalty[column] = float(
+            shifts_data["shift_priority_dict"].get(shift, 1) ** 50
+        )
+
+    gender_dict = people_data["gender_dict"]
+    experience_dict = people_data.get("experience_dict")
+    gender_vector = np.zeros(num_people)
+    experience_vector = np.zeros(num_people)
+    for person, row in person_index_dict.items():
+        gender_vector[row] = (gender_dict or {}).get(person) or 0
+        experience_vector[row] = (experience_dict or {}).get(person) or 0
+
+    return {
+        "friend_matrix": friend_matrix,
+        "enemy_matrix": enemy_matrix,
+        "friend_count": friend_count,
+        "same_time_matrix": same_time_matrix,
+        "night_vector": night_vector,
+        "shift_type_matrix": shift_type_matrix,
+        "type_listed": type_listed,
+        "type_min": type_min,
+        "type_max": type_max,
+        "mandatory_matrix": mandatory_matrix,
+        "mandatory_owner": np.array(mandatory_owner, dtype=int),
+        "mandatory_owner_matrix": mandatory_owner_matrix,
+        "mandatory_required": mandatory_required,
+        "min_capacity": min_capacity,
+        "priority_penalty": priority_penalty,
+        "gender_vector": gender_vector,
+        "use_gender_cost": bool(gender_dict),
+        "experience_vector": experience_vector,
+        "use_experience_cost": USE_EXPERIENCE_COST and bool(experience_dict),
+        "off_day_matrix": people_data["off_day_matrix"],
+        "shift_preference_cost_matrix": people_data["shift_preference_cost_matrix"],
+    }
+
+
+def assignment_matrix(assigned_shifts, people_data, shifts_data):
+    """
+    Convert the assigned shifts of every person to a boolean people x shifts matrix.
+
+    Args:
+    - assigned_shifts (dict): The shifts assigned to each person
+    - people_data (dict): The people data
+    - shifts_data (dict): The shifts data
+
+    Returns:
+    - np.ndarray: The assignment matrix
+    """
+    person_index_dict = people_data["person_index_dict"]
+    shift_index_dict = shifts_data["shift_index_dict"]
+    assignment = np.zeros((len(person_index_dict), len(shift_index_dict)), dtype=bool)
+    for person, shifts in assigned_shifts.items():
+        for shift in shifts:
+            assignment[person_index_dict[person], shift_index_dict[shift]] = True
+    return assignment
+
+
+def vectorized_individual_costs(assignment, cost_arrays):
+    """
+    Calculate the individual cost of every person with array operations.
+
+    Args:
+    - assignment (np.ndarray): A (..., people, shifts) boolean assignment matrix
+    - cost_arrays (dict): The output of build_cost_arrays
+
+    Returns:
+    - np.ndarray: A (..., people) array with the individual costs
+    """
+    assignment = assignment.astype(float)
+    shift_counts = assignment.sum(axis=-1)
+
+    # Preference cost: colleagues in the same shift and in other shifts at the same time
+    same_shift = assignment @ np.swapaxes(assignment, -1, -2)
+    same_time_shifts = (assignment @ cost_arrays["same_time_matrix"] > 0) & (
+        assignment == 0
+    )
+    same_time = same_time_shifts.astype(float) @ np.swapaxes(assignment, -1, -2)
+    colleague_matches = same_shift + SAME_TIME_FACTOR * same_time
+    friends_count = (cost_arrays["friend_matrix"] * colleague_matches).sum(axis=-1)
+    enemies_count = (cost_arrays["enemy_matrix"] * colleague_matches).sum(axis=-1)
+    total_possible_matches = cost_arrays["friend_count"] * shift_counts
+    preference_costs = (
+        np.maximum(total_possible_matches - friends_count, 0) * FRIEND_FACTOR
+        + enemies_count * ENEMY_FACTOR
+    )
+
+    # Off-day and time frame costs
+    off_day_costs = (assignment * cost_arrays["off_day_matrix"]).sum(axis=-1) * OFF_DAY_FACTOR
+    time_frame_costs = (
+        assignment * cost_arrays["shift_preference_cost_matrix"]
+    ).sum(axis=-1) * SHIFT_RANKING_FACTOR
+    night_shift_count = assignment @ cost_arrays["night_vector"]
+    time_frame_costs += np.where(
+        night_shift_count > 1,
+        shift_counts / np.maximum(night_shift_count, 1) * NIGHT_SHIFT_FACTOR,
+        0,
+    )
+
+    # Shift type cost (people without shift types act as a "joker")
+    type_counts = assignment @ cost_arrays["shift_type_matrix"]
+    type_min = cost_arrays["type_min"]
+    type_max = cost_arrays["type_max"]
+    type_penalties = (
+        ((type_min > 0) & (type_counts < type_min)).astype(float)
+        + ((type_max > 0) & (type_counts > type_max))
+        + 2 * ((type_min == 0) & (type_max == 0) & (type_counts == 0))
+    )
+    shift_type_costs = (
+        type_penalties * cost_arrays["type_listed"]
+    ).sum(axis=-1) * SHIFT_TYPE_FACTOR
+
+    # Mandatory cost: every mandatory period needs an assigned shift inside it
+    satisfied_periods = (
+        assignment[..., cost_arrays["mandatory_owner"], :] * cost_arrays["mandatory_matrix"]
+    ).sum(axis=-1) > 0
+    satisfied_count = satisfied_periods.astype(float) @ cost_arrays["mandatory_owner_matrix"]
+    mandatory_costs = np.where(
+        satisfied_count >= cost_arrays["mandatory_required"], 0, MANDATORY_FACTOR
+    )
+
+    return (
+        preference_costs
+        + off_day_costs
+        + time_frame_costs
+        + shift_type_costs
+        + mandatory_costs
+    )
+
+
+def vectorized_cost_function(assignment, cost_arrays):
+    """
+    Calculate the total cost of one or more schedules given as assignment matrices.
+
+    Produces the same totals as cost_calculation.cost_function. A stack of
+    assignment matrices is scored in one call.
+
+    Args:
+    - assignment (np.ndarray): A (..., people, shifts) boolean assignment matrix
+    - cost_arrays (dict): The output of build_cost_arrays
+
+    Returns:
+    - np.ndarray: The total cost of every schedule (a 0-d array for a single schedule)
+    - np.ndarray: The individual cost of every person in every schedule
+    """
+    individual_costs = vectorized_individual_costs(assignment, cost_arrays)
+
+    # Balance cost from the sample standard deviation of the individual costs
+    num_people = individual_costs.shape[-1]
+    individual_balance_cost = 0
+    if num_people > 1:
+        individual_balance_cost = individual_costs.std(axis=-1, ddof=1) * BALANCE_FACTOR
+
+    # Priority cost of the shifts below their minimum capacity
+    shift_sizes = assignment.sum(axis=-2)
+    priority_cost = (shift_sizes < cost_arrays["min_capacity"]) @ cost_arrays[
+        "priority_penalty"
+    ]
+
+    # Gender and experience distribution costs
+    gender_cost = 0
+    if cost_arrays["use_gender_cost"]:
+        gender_cost = (
+            shift_distribution_deviation(
+                cost_arrays["gender_vector"], assignment, shift_sizes
+            )
+            * GENDER_DISTRIBUTION_FACTOR
+        )
+    experience_cost = 0
+    if cost_arrays["use_experience_cost"]:
+        experience_cost = (
+            shift_distribution_deviation(
+                cost_arrays["experience_vector"], assignment, shift_sizes
+            )
+            * EXPERIENCE_FACTOR
+        )
+
+    total_cost = (
+        individual_costs.sum(axis=-1)
+        + priority_cost
+        + individual_balance_cost
+        + gender_cost
+        + experience_cost
+    )
+    return total_cost, individual_costs
+
+
+def shift_distribution_deviation(value_vector, assignment, shift_sizes):
+    """
+    Calculate the sample standard deviation of the shift averages over the non-empty shifts.
+
+    Args:
+    - value_vector (np.ndarray): The value (e.g. gender) of every person
+    - assignment (np.ndarray): A (..., people, shifts) boolean assignment matrix
+    - shift_sizes (np.ndarray): The number of people in every shift
+
+    Returns:
+    - np.ndarray: The standard deviation of every schedule, 0 for less than two
+      staffed shifts (like cost_calculation.sample_stdev)
+    """
+    staffed = shift_sizes > 0
+    shift_averages = (value_vector @ assignment) / np.maximum(shift_sizes, 1)
+    staffed_count = staffed.sum(axis=-1)
+    mean = (shift_averages * staffed).sum(axis=-1) / np.maximum(staffed_count, 1)
+    variance = (((shift_averages - mean[..., None]) * staffed) ** 2).sum(axis=-1) / (
+        np.maximum(staffed_count - 1, 1)
+    )
+    return np.where(staffed_count < 2, 0.0, np.sqrt(variance))
+
+
+def batch_cost_function(assigned_shifts_list, people_data, shifts_data, cost_arrays=None):
+    """
+    Score several candidate schedules in one vectorized call.
+
+    Args:
+    - assigned_shifts_list (list): The assigned shifts (dict) of every candidate schedule
+    - people_data (dict): The people data
+    - shifts_data (dict): The shifts data
+    - cost_arrays (dict): The output of build_cost_arrays, built if not given
+
+    Returns:
+    - np.ndarray: The total cost of every candidate schedule
+    """
+    if cost_arrays is None:
+        cost_arrays = build_cost_arrays(people_data, shifts_data)
+
+    assignments = np.stack(
+        [
+            assignment_matrix(assigned_shifts, people_data, shifts_data)
+            for assigned_shifts in assigned_shifts_list
+        ]
+    )
+    total_costs, _ = vectorized_cost_function(assignments, cost_arrays)
+    return total_costs